@@ -0,0 +1,472 @@
+"""Benchmarks for the scripts/ pipeline on a synthetic conference.
+
+Usage:
+    python scripts/benchmark.py [--scales 100 1000 5000 20000] [--output bench_results.jsonl]
+    python scripts/benchmark.py --compare [--rows 10000] [--papers 5000]
+
+The default mode generates presentations.csv, meet-and-greet CSVs,
+Zoom users and meeting JSON at each scale in a temporary directory, times
+every stage of the pipeline and appends one JSON line per stage (tagged
+with the current commit) to `--output`, so runs can be compared across
+commits. `--compare` instead times the current implementations against
+the ones they replaced and checks the outputs match; with `jekyll` on the
+PATH it also compares `jekyll build` times for program stubs against
+pages rendered by `make_program(render=True)`, and that the output is
+identical.
+"""
+
+import argparse
+import contextlib
+import datetime
+import filecmp
+import io
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+import pandas as pd
+import yaml
+
+try:
+    import secret  # noqa: F401
+except ImportError:
+    # Nothing here talks to Zoom or SMTP; placeholder credentials let the
+    # benchmark import the scripts on machines without a secret.py.
+    secret = types.ModuleType("secret")
+    secret.TOKEN = secret.PASSWORD = secret.SENDER_PASSWORD = ""
+    secret.USER_EMAIL_TEMPLATE = "host+{}@example.com"
+    secret.SENDER_EMAIL = "bench@example.com"
+    sys.modules["secret"] = secret
+
+import utils
+from make_program import make_jekyll_data, make_program, add_zoom_links
+from meet_and_greet import make_meet_and_greet_groups
+from send_emails import get_presenter_meetings, get_presenter_email_body, load_template
+from utils import load_meet_and_greet_data, load_presentation_data
+
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TIMESLOTS = ["1:00-1:30 PM", "8:00-8:30 PM"]
+SESSIONS = ["3:30-4:30pm", "11:00-11:59pm"]
+KINDS = ["oral", "spotlight", "poster", "poster", "poster"]
+WORDS = ("object centric representation learning slot attention scene graph "
+         "physical reasoning compositional generalisation segmentation video "
+         "perception neural network unsupervised discovery dynamics").split()
+# Mixed into names and abstracts: YAML dumpers differ in how they wrap non-ASCII.
+ACCENTED_WORDS = "müller garcía dvořák łukasz zoë schrödinger naïve über–net café".split()
+ACADEMIC_STATUSES = ["PhD student", "Postdoc", "Professor", "Industry researcher", ""]
+
+
+def make_meet_and_greet(directory, n_rows, seed=0):
+    """Writes `meet_and_greet.csv`, `meet_and_greet_details.csv` and
+    `meet_and_greet_signups.csv` with `n_rows` groups' worth of people."""
+    rng = random.Random(seed)
+    n_people = n_rows * 3
+    people = [("Person {}".format(i), "person{}@example.com".format(i)) for i in range(n_people)]
+
+    groups = []
+    for _ in range(n_rows):
+        members = rng.sample(people, rng.choice([2, 3, 4]))
+        group = {"timeslot": rng.choice(TIMESLOTS)}
+        for j in [1, 2, 3, 4]:
+            name, email = members[j - 1] if j <= len(members) else ("", "")
+            group["name_{}".format(j)] = name
+            group["email_{}".format(j)] = email
+        groups.append(group)
+
+    details = []
+    for i, (name, email) in enumerate(people):
+        details.append({
+            "email": email,
+            "institution": "University {}".format(rng.randrange(500)),
+            "academic_status": rng.choice(ACADEMIC_STATUSES),
+            "google_scholar": "https://scholar.google.com/citations?user={}".format(i) if i % 2 else "",
+            "website": "https://example.com/~{}".format(i) if i % 3 else "",
+            "interests": ", ".join(rng.sample(WORDS, rng.randrange(4))),
+        })
+    signups = [{"name": name, "email": email, "timeslot": rng.choice(TIMESLOTS)}
+               for name, email in people]
+
+    path = os.path.join(directory, "meet_and_greet.csv")
+    details_path = os.path.join(directory, "meet_and_greet_details.csv")
+    pd.DataFrame(groups).to_csv(path, index=False)
+    pd.DataFrame(details).to_csv(details_path, index=False)
+    pd.DataFrame(signups).to_csv(os.path.join(directory, "meet_and_greet_signups.csv"), index=False)
+    return path, details_path
+
+
+def make_presentations(directory, n_papers, seed=0):
+    """Writes `scripts/data/presentations.csv` with `n_papers` papers and 4 talks under `directory`."""
+    rng = random.Random(seed)
+
+    def words(n):
+        return " ".join(rng.choice(ACCENTED_WORDS if rng.random() < 0.05 else WORDS)
+                        for _ in range(n))
+
+    rows = []
+    for i in range(1, n_papers + 5):
+        if i <= 4:
+            session, kind = ("opening", "opening") if i == 1 else ("invited", "oral")
+        else:
+            session, kind = rng.choice(SESSIONS), rng.choice(KINDS)
+        authors = "; ".join(
+            "{}, {}".format(words(1).title(), words(1).title())
+            for _ in range(rng.randint(1, 8)))
+        rows.append({
+            "unique_id": i,
+            "slides_live_id": 38930000 + i,
+            "authors": authors,
+            "camera_ready": rng.random() < 0.9,
+            "cmt_id": i,
+            "kind": kind,
+            "session": session,
+            "title": words(8).capitalize(),
+            "abstract": words(150).capitalize() + ".",
+            "track": "research",
+            "live": False,
+            "video_file_url": "",
+            "youtube_url": "https://www.youtube.com/watch?v={:011d}".format(i),
+            "presenter_email": "presenter{}@example.com".format(i),
+            "presenter_name": "Presenter {}".format(i),
+        })
+
+    data_dir = os.path.join(directory, "scripts", "data")
+    os.makedirs(data_dir, exist_ok=True)
+    os.makedirs(os.path.join(directory, "_data"), exist_ok=True)
+    os.makedirs(os.path.join(directory, "program"), exist_ok=True)
+    path = os.path.join(data_dir, "presentations.csv")
+    pd.DataFrame(rows).to_csv(path, index=False)
+    return path
+
+
+PRESENTER_TEMPLATE = """<p>Dear {presenter_name},</p>
+<p>Your paper "{title}" ({authors}) is presented in {session_title}.</p>
+<p>Zoom host account: {host_email} / {host_password}<br>
+Start the meeting: <a href="{start_url}">{start_url}</a><br>
+Attendees join at <a href="{join_url}">{join_url}</a> (password {meeting_password}).</p>
+"""
+
+
+def make_zoom_data(directory, n_papers, n_hosts, seed=0):
+    """Writes Zoom users, host accounts and one meeting per paper under `directory`."""
+    rng = random.Random(seed)
+    users = [
+        {"id": "host{:05d}".format(i), "email": "host+{}@example.com".format(i), "type": 2}
+        for i in range(n_hosts)
+    ]
+    pd.DataFrame({
+        "email": [user["email"] for user in users],
+        "password": ["secret{}".format(i) for i in range(n_hosts)],
+    }).to_csv(os.path.join(directory, "scripts", "data", "zoom_accounts.csv"), index=False)
+
+    meetings = {"users": users}
+    for i in range(1, n_papers + 5):
+        meeting_id = 80000000000 + i
+        meetings["OOL_{}".format(i)] = {
+            "id": meeting_id,
+            "host_id": users[i % n_hosts]["id"],
+            "topic": "Paper {}".format(i),
+            "start_url": "https://zoom.us/s/{}?zak={:x}".format(meeting_id, rng.getrandbits(128)),
+            "join_url": "https://zoom.us/j/{}?pwd={:x}".format(meeting_id, rng.getrandbits(96)),
+            "password": "pw{}".format(i % 1000),
+        }
+    store = utils.MeetingStore(os.path.join(directory, utils.MEETINGS_DB), legacy_dir=None)
+    store.put_many(meetings)
+
+    template_dir = os.path.join(directory, "scripts", "templates")
+    os.makedirs(template_dir, exist_ok=True)
+    with open(os.path.join(template_dir, "presenter.html"), "w") as fh:
+        fh.write(PRESENTER_TEMPLATE)
+
+
+def make_conference(directory, n_papers, seed=0):
+    """Writes every input the pipeline reads for a conference of `n_papers`."""
+    make_presentations(directory, n_papers, seed)
+    make_meet_and_greet(os.path.join(directory, "scripts", "data"), max(1, n_papers // 2), seed)
+    make_zoom_data(directory, n_papers, max(1, n_papers // 10), seed)
+    shutil.copytree(os.path.join(REPO, "_layouts"), os.path.join(directory, "_layouts"))
+
+
+def _reset_caches():
+    """Drops the in-process caches so each scale starts cold."""
+    utils._meeting_store = None
+    utils._presentation_data.clear()
+    load_template.cache_clear()
+
+
+@contextlib.contextmanager
+def _chdir(directory):
+    """The scripts use paths relative to the repository root."""
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+
+def _load_meet_and_greet_data_iterrows(path, details_path):
+    """The row-by-row implementation `load_meet_and_greet_data` replaced."""
+    def _get_names(meeting):
+        cols = sorted([x for x in meeting.index if x.startswith("name_")])
+        names = [meeting[x] for x in cols]
+        names = [x for x in names if x]
+        if len(names) == 2:
+            names = "{} and {}".format(*names)
+        else:
+            names = ", ".join(names[:-1]) + ", and " + names[-1]
+        return names
+
+    def _get_emails(meeting):
+        cols = sorted([x for x in meeting.index if x.startswith("email_")])
+        emails = [meeting[x] for x in cols]
+        emails = [x for x in emails if x]
+        return ", ".join(emails)
+
+    data = pd.read_csv(path)
+    data.index.name = "unique_id"
+    data = data.reset_index()
+    data = data.fillna("")
+    data["names"] = ""
+    data["emails"] = ""
+    data = data.rename(columns={"timeslot": "session"})
+    data["session_title"] = data["session"].replace({
+        "1:00-1:30 PM": "1:00-1:30pm GMT",
+        "8:00-8:30 PM": "8:00-8:30pm GMT"
+    })
+    data["session"] = data["session"].replace({
+        "1:00-1:30 PM": 1,
+        "8:00-8:30 PM": 2
+    })
+
+    detail_keys = ["institution", "academic_status", "google_scholar", "website"]
+    for key in detail_keys:
+        for j in [1, 2, 3, 4]:
+            data["{}_{}".format(key, j)] = ""
+
+    all_details = pd.read_csv(details_path)
+    all_details = all_details.set_index("email")
+    all_details = all_details.fillna("")
+
+    for i, row in data.iterrows():
+        data.loc[i, "names"] = _get_names(row)
+        data.loc[i, "emails"] = _get_emails(row)
+        for j in [1, 2, 3, 4]:
+            email = row["email_{}".format(j)]
+            if not email:
+                continue
+            details = all_details.loc[email]
+            for key in detail_keys:
+                data.loc[i, "{}_{}".format(key, j)] = details[key]
+
+    return data
+
+
+def _make_jekyll_data_query():
+    """The query/concat implementation `make_jekyll_data` replaced."""
+    data = load_presentation_data()
+    data = data.sort_values(by="authors")
+    data = data.rename(columns={
+        "session_id": "session",
+        "unique_id": "id"
+    })
+    data = data.drop(columns=[
+        "presenter_email",
+        "presenter_name",
+        "slides_live_id",
+        "live",
+    ])
+
+    sessions = []
+    for session in [1, 2]:
+        session_data = data.query("session == {}".format(session))
+        session_title, = session_data["session_title"].unique()
+        session_data = pd.concat([
+            session_data.query("kind == 'oral'"),
+            session_data.query("kind == 'spotlight'"),
+            session_data.query("kind == 'poster'"),
+        ])
+        session_data = session_data.drop(columns=[
+            "session_title",
+            "video_file_url",
+            "youtube_url",
+        ])
+        sessions.append({
+            "id": session,
+            "title": session_title,
+            "papers": session_data.to_dict(orient="records")
+        })
+    with open("_data/sessions.yml", "w") as fh:
+        yaml.dump(sessions, fh)
+
+    speakers = data.query("session == 0")
+    speakers = speakers.sort_values(by="id")
+    speakers = speakers.drop(columns=[
+        "cmt_id",
+        "camera_ready",
+        "session",
+        "session_title",
+        "track",
+        "video_file_url",
+        "youtube_url",
+    ])
+    speakers = speakers.to_dict(orient="records")
+    with open("_data/speakers.yml", "w") as fh:
+        yaml.dump(speakers, fh)
+
+
+def _time(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def bench_meet_and_greet(n_rows):
+    with tempfile.TemporaryDirectory() as directory:
+        paths = make_meet_and_greet(directory, n_rows)
+        new, new_time = _time(load_meet_and_greet_data, *paths)
+        old, old_time = _time(_load_meet_and_greet_data_iterrows, *paths)
+
+    pd.testing.assert_frame_equal(new, old)
+    print("load_meet_and_greet_data ({} rows): {:.3f}s vs {:.3f}s with iterrows ({:.0f}x)".format(
+        n_rows, new_time, old_time, old_time / new_time))
+
+
+def bench_make_jekyll_data(n_papers):
+    with tempfile.TemporaryDirectory() as directory, _chdir(directory):
+        make_presentations(directory, n_papers)
+        load_presentation_data()  # parse outside the timings
+
+        _, old_time = _time(_make_jekyll_data_query)
+        os.rename("_data/sessions.yml", "_data/sessions_old.yml")
+        os.rename("_data/speakers.yml", "_data/speakers_old.yml")
+        _, new_time = _time(make_jekyll_data)
+        # Compared as data: libyaml wraps non-ASCII text differently.
+        for name in ["sessions", "speakers"]:
+            with open("_data/{}.yml".format(name)) as new, open("_data/{}_old.yml".format(name)) as old:
+                assert yaml.safe_load(new) == yaml.safe_load(old), name
+
+    print("make_jekyll_data ({} papers): {:.3f}s vs {:.3f}s with query/concat ({:.1f}x)".format(
+        n_papers, new_time, old_time, old_time / new_time))
+
+
+def _jekyll_build():
+    """Runs `jekyll build` in the current directory; returns its time, or None without Jekyll."""
+    if shutil.which("jekyll") is None:
+        return None
+    _, seconds = _time(subprocess.check_call, ["jekyll", "build", "--quiet", "-d", "_site"])
+    return seconds
+
+
+def bench_render_pages(n_papers):
+    """Compares Jekyll-rendered program stubs with pages rendered by make_program."""
+    with tempfile.TemporaryDirectory() as directory, _chdir(directory):
+        make_conference(directory, n_papers)
+        shutil.copy(os.path.join(REPO, "_config.yml"), "_config.yml")
+        load_presentation_data()  # parse outside the timings
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, stub_time = _time(make_program, False)
+        stub_build = _jekyll_build()
+        if stub_build is not None:
+            os.rename(os.path.join("_site", "program"), "stub_site")
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, render_time = _time(make_program, True)
+        render_build = _jekyll_build()
+
+        print("make_program ({} papers): {:.3f}s writing stubs, {:.3f}s rendering pages".format(
+            n_papers, stub_time, render_time))
+        if stub_build is None:
+            print("jekyll not found; skipping the build comparison")
+            return
+        names = sorted(os.listdir("stub_site"))
+        match, mismatch, errors = filecmp.cmpfiles(
+            "stub_site", os.path.join("_site", "program"), names, shallow=False)
+        assert not mismatch and not errors, "rendered pages differ from Jekyll's: {}".format(
+            ", ".join((mismatch + errors)[:5]))
+        print("jekyll build: {:.2f}s with stubs vs {:.2f}s with rendered pages ({:.1f}x); "
+              "{} pages identical".format(stub_build, render_build, stub_build / render_build, len(match)))
+
+
+def _render_presenter_emails(meetings):
+    return [get_presenter_email_body(meeting) for meeting in meetings]
+
+
+def _commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(scales, output):
+    """Times every pipeline stage at each scale; appends the results to `output`."""
+    output = os.path.abspath(output)
+    run = {
+        "commit": _commit(),
+        "time": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "pandas": pd.__version__,
+    }
+    results = []
+
+    for n_papers in scales:
+        with tempfile.TemporaryDirectory() as directory, _chdir(directory):
+            make_conference(directory, n_papers)
+            _reset_caches()
+
+            def stage(name, fn, *args):
+                # The scripts report progress with print; keep the table readable.
+                with contextlib.redirect_stdout(io.StringIO()):
+                    result, seconds = _time(fn, *args)
+                results.append(dict(run, papers=n_papers, stage=name, seconds=round(seconds, 5)))
+                print("{:>6} papers  {:<34} {:9.4f}s".format(n_papers, name, seconds))
+                return result
+
+            stage("load_presentation_data (parse)", load_presentation_data)
+            utils._presentation_data.clear()
+            stage("load_presentation_data (cached)", load_presentation_data)
+            stage("load_meet_and_greet_data", load_meet_and_greet_data)
+            stage("form meet-and-greet groups", make_meet_and_greet_groups,
+                  "scripts/data/meet_and_greet_signups.csv", "scripts/data/meet_and_greet_details.csv",
+                  "meet_and_greet_groups.csv")
+            stage("make_jekyll_data", make_jekyll_data)
+            stage("make_program (full)", make_program)
+            stage("make_program (unchanged)", make_program)
+            stage("make_program (render)", make_program, True)
+            stage("make_program (back to stubs)", make_program, False)
+            stage("add_zoom_links", add_zoom_links)
+            meetings = stage("get_zoom_meetings + merges", get_presenter_meetings)
+            stage("render presenter emails", _render_presenter_emails, meetings)
+            _reset_caches()
+
+    with open(output, "a") as fh:
+        for result in results:
+            fh.write(json.dumps(result) + "\n")
+    print("Appended {} results to {}".format(len(results), output))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scales", type=int, nargs="+", default=[100, 1000, 5000, 20000],
+                        help="numbers of papers to benchmark the pipeline at")
+    parser.add_argument("--output", default="bench_results.jsonl")
+    parser.add_argument("--compare", action="store_true",
+                        help="compare against the previous implementations instead")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--papers", type=int, default=5000)
+    args = parser.parse_args()
+    if args.compare:
+        bench_meet_and_greet(args.rows)
+        bench_make_jekyll_data(args.papers)
+        bench_render_pages(args.papers)
+    else:
+        run_suite(args.scales, args.output)
@@ -1,33 +1,157 @@
-"""Script for downloading videos from gdrive and dropbox; it's not perfect but does part of the job."""
-import sys
+"""Script for downloading videos from gdrive and dropbox; it's not perfect but does part of the job.
+
+Usage:
+    python scripts/download_videos.py submissions.csv [--workers 8] [--gdrive-workers 4] [--dropbox-workers 4]
+
+Downloads run in a thread pool. Each host additionally gets its own
+concurrency cap so we don't trip Google Drive or Dropbox throttling.
+
+Every download is recorded in `videos/manifest.json` (cmt_id -> link,
+path, size, sha256 and the HTTP validators the host sent). On a rerun:
+- an interrupted download is resumed from `videos/<cmt_id>.<ext>.part`
+  with a Range request, as long as the host still reports the same version;
+- a finished video is revalidated with If-None-Match/If-Modified-Since
+  (falling back to comparing ETag/Last-Modified/Content-Length) and only
+  fetched again if it changed or the local copy no longer matches;
+- a video whose link changed in the sheet is fetched from scratch.
+Pass --no-revalidate to trust the manifest without touching the network.
+
+The file type is sniffed from the first streamed bytes and the SHA-256 is
+computed in flight, so a video is written once and never read back.
+Videos with identical content are stored once (hard-linked).
+"""
+import argparse
+import hashlib
+import itertools
+import json
 import os
 import os.path as osp
 import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd
 import requests
 import tqdm
 import filetype
 import re
 
+import instrument
+from utils import file_sha256, hash_file, write_json_atomic
+
 CMT_ID = 'CMT ID'
 VIDEO_LINK = 'Link to the video'
 DEST = 'videos'
+MANIFEST = osp.join(DEST, 'manifest.json')
 GDRIVE_URL = 'https://docs.google.com/uc?export=download'
+CHUNK_SIZE = 32768
+SNIFF_SIZE = 8192  # enough for every signature `filetype` knows about
+
+WORKERS = 8
+HOST_LIMITS = {
+    'gdrive': 4,
+    'dropbox': 4,
+    'generic': 2,
+}
+
+
+class _Progress:
+    """Aggregate progress over all concurrent downloads."""
+
+    def __init__(self, n_videos):
+        self.n_videos = n_videos
+        self.done = 0
+        self.unchanged = 0
+        self.duplicates = 0
+        self.failed = 0
+        self.skipped = 0
+        self.nbytes = 0
+        self._lock = threading.Lock()
+        self._start = time.time()
+        self._bar = tqdm.tqdm(unit='B', unit_scale=True, unit_divisor=1024)
+
+    def update(self, nbytes):
+        with self._lock:
+            self.nbytes += nbytes
+            self._bar.update(nbytes)
+
+    def finish(self, status):
+        with self._lock:
+            if status in ('downloaded', 'duplicate'):
+                self.done += 1
+                if status == 'duplicate':
+                    self.duplicates += 1
+            elif status == 'unchanged':
+                self.unchanged += 1
+            else:
+                self.failed += 1
+            self._bar.set_postfix(done=self.done, unchanged=self.unchanged,
+                                  failed=self.failed, total=self.n_videos - self.skipped)
+
+    def skip(self):
+        with self._lock:
+            self.skipped += 1
+
+    def summary(self):
+        self._bar.close()
+        elapsed = time.time() - self._start
+        mb = self.nbytes / 2 ** 20
+        rate = mb / elapsed if elapsed > 0 else 0.
+        print(f'Downloaded {self.done} videos ({mb:.1f} MiB) in {elapsed:.1f}s '
+              f'[{rate:.2f} MiB/s]; {self.duplicates} duplicates, {self.unchanged} unchanged, '
+              f'{self.failed} failed, {self.skipped} skipped.')
+
+
+class Manifest:
+    """Thread-safe, persistent record of what has been downloaded."""
+
+    def __init__(self, path=MANIFEST):
+        self.path = path
+        self._lock = threading.Lock()
+        if osp.exists(path):
+            with open(path, 'r') as fh:
+                self._entries = json.load(fh)
+        else:
+            self._entries = {}
+
+    def get(self, cmt_id):
+        with self._lock:
+            return dict(self._entries.get(str(cmt_id), {}))
+
+    def find(self, sha256, exclude=None):
+        """Returns the cmt_id and entry of a finished video with this hash, if any."""
+        with self._lock:
+            for cmt_id, entry in self._entries.items():
+                if cmt_id != str(exclude) and entry.get('sha256') == sha256 and entry.get('path'):
+                    return cmt_id, dict(entry)
+        return None, None
+
+    def update(self, cmt_id, **fields):
+        with self._lock:
+            entry = self._entries.setdefault(str(cmt_id), {})
+            entry.update(fields)
+            self._save()
 
+    def _save(self):
+        write_json_atomic(self.path, self._entries, indent=1, sort_keys=True)
 
-def _download_from_gdrive(file_id, destination):
+
+def _open_gdrive(link, headers):
+    link = _gdrive_link_pattern.match(link).groups()[0]
+    file_id = link.split('/')[-1]
 
     session = requests.Session()
 
     params = dict(id=file_id)
-    response = session.get(GDRIVE_URL, params=params, stream=True)
+    response = session.get(GDRIVE_URL, params=params, headers=headers, stream=True)
     token = _get_confirm_token(response)
 
     if token:
+        response.close()
         params['confirm'] = token
-        response = session.get(GDRIVE_URL, params=params, stream=True)
+        response = session.get(GDRIVE_URL, params=params, headers=headers, stream=True)
 
-    _save_response_content(response, destination)    
+    return response
 
 def _get_confirm_token(response):
     for key, value in response.cookies.items():
@@ -37,92 +161,272 @@ def _get_confirm_token(response):
     return None
 
 
-def _download_from_dropbox(link, destination):
+def _open_dropbox(link, headers):
 
     session = requests.Session()
 
-    headers = {'user-agent': 'Wget/1.16 (linux-gnu)'}
-    response = session.get(link, headers=headers, stream=True)
-    _save_response_content(response, destination)    
+    headers = dict(headers, **{'user-agent': 'Wget/1.16 (linux-gnu)'})
+    return session.get(link, headers=headers, stream=True)
 
 
-def _save_response_content(response, destination):
-    CHUNK_SIZE = 32768
+def _open_generic(link, headers):
+    raise NotImplementedError
 
-    with open(destination, "wb") as f:
-        for chunk in tqdm.tqdm(response.iter_content(CHUNK_SIZE)):
+
+def _save_response_content(response, destination, mode='wb', hasher=None, progress=None):
+    """Streams `response` to disk, hashing chunks as they pass through.
+
+    `destination` is either a path or a callable that picks the path from
+    the first bytes of the stream, so the file type can be sniffed without
+    reading the file back. Returns the path written and the bytes written.
+    """
+    chunks = response.iter_content(CHUNK_SIZE)
+    head = b''
+    if callable(destination):
+        for chunk in chunks:
+            head += chunk
+            if len(head) >= SNIFF_SIZE:
+                break
+        destination = destination(head)
+
+    size = 0
+    with open(destination, mode) as f:
+        for chunk in itertools.chain([head], chunks):
             if chunk: # filter out keep-alive new chunks
                 f.write(chunk)
+                size += len(chunk)
+                if hasher is not None:
+                    hasher.update(chunk)
+                if progress is not None:
+                    progress.update(len(chunk))
+                instrument.count('download_bytes', len(chunk))
+    return destination, size
 
 
-_gdrive_link_pattern = re.compile(r'(.*?)(/view.*|/edit.*|$).*')
-
-
-def download_from_gdrive(link):
-    link = _gdrive_link_pattern.match(link).groups()[0]
-
-    file_id = link.split('/')[-1]
-    filename = 'gdrive_file'
-    _download_from_gdrive(file_id, filename)
-    return filename
-
+def _guess_extension(head):
+    kind = filetype.guess(head)
+    return '' if kind is None else '.' + kind.extension
 
-def download_from_dropbox(link):
-    filename = 'dropbox_file'
-    #dropbox.sharing_get_shared_link_file_to_file(filename, link)
 
-    _download_from_dropbox(link, filename)
-    return filename
-
-
-def download_generic(link):
-    raise NotImplementedError
+_gdrive_link_pattern = re.compile(r'(.*?)(/view.*|/edit.*|$).*')
 
 
-def download_file(link):
+def link_host(link):
     if 'google' in link:
-        return download_from_gdrive(link)
+        return 'gdrive'
     elif 'dropbox' in link:
-        return download_from_dropbox(link)
+        return 'dropbox'
     else:
-        return download_generic(link)
+        return 'generic'
+
+
+_openers = {
+    'gdrive': _open_gdrive,
+    'dropbox': _open_dropbox,
+    'generic': _open_generic,
+}
+
+
+def open_link(link, headers=None):
+    """Opens a streaming response for `link`, following host-specific quirks."""
+    host = link_host(link)
+    start = time.perf_counter()
+    response = _openers[host](link, headers or {})
+    instrument.record_http(host, 'GET', 'download', response.status_code, time.perf_counter() - start)
+    return response
+
+
+def _validators(response):
+    """Returns the HTTP validators describing the full remote file."""
+    length = response.headers.get('Content-Length')
+    content_range = response.headers.get('Content-Range')
+    if response.status_code == 206 and content_range and '/' in content_range:
+        length = content_range.rsplit('/', 1)[1]
+    return {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'content_length': int(length) if length and length.isdigit() else None,
+    }
+
+
+def _same_version(old, new):
+    if old.get('etag') and new.get('etag'):
+        return old['etag'] == new['etag']
+    if old.get('last_modified') and new.get('last_modified'):
+        if old['last_modified'] != new['last_modified']:
+            return False
+    elif not (old.get('content_length') and new.get('content_length')):
+        return False
+    if old.get('content_length') and new.get('content_length'):
+        return old['content_length'] == new['content_length']
+    return True
+
+
+def _existing_videos():
+    existing = {}
+    for f in os.listdir(DEST):
+        stem, ext = osp.splitext(f)
+        if ext != '.part' and stem.isdigit():
+            existing[int(stem)] = osp.join(DEST, f)
+    return existing
+
+
+def _is_complete(entry):
+    path = entry.get('path')
+    return bool(path) and osp.exists(path) and osp.getsize(path) == entry.get('size')
+
+
+_finalize_lock = threading.Lock()
+
+
+def _fetch(cmt_id, vid_link, host_slots, progress, manifest, legacy_path=None, revalidate=True):
+    """Brings `DEST/<cmt_id>.<ext>` up to date with `vid_link`.
+
+    The extension is sniffed from the first streamed bytes and the SHA-256
+    is computed while streaming, so the video is never read back from disk.
+    Returns 'downloaded', 'duplicate' or 'unchanged'.
+    """
+    entry = manifest.get(cmt_id)
+    partial = entry.get('partial') or {}
+    part = partial.get('path')
+    if entry.get('link') != vid_link:
+        entry = {}
+        if part and osp.exists(part):
+            os.remove(part)
+        part = None
+
+    headers = {}
+    complete = bool(entry) and _is_complete(entry)
+    if complete:
+        if not revalidate:
+            return 'unchanged'
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+    offset = osp.getsize(part) if part and osp.exists(part) else 0
+    if offset and (partial.get('etag') or partial.get('last_modified')):
+        headers['Range'] = f'bytes={offset}-'
+        headers['If-Range'] = partial.get('etag') or partial['last_modified']
+    else:
+        offset = 0
+
+    with host_slots[link_host(vid_link)]:
+        response = open_link(vid_link, headers)
+        try:
+            if response.status_code == 304:
+                return 'unchanged'
+            response.raise_for_status()
+            validators = _validators(response)
+
+            if complete and _same_version(entry, validators):
+                return 'unchanged'
+            if not entry and legacy_path and validators['content_length'] == osp.getsize(legacy_path):
+                # Adopt a video downloaded before the manifest existed.
+                manifest.update(cmt_id, link=vid_link, path=legacy_path, size=osp.getsize(legacy_path),
+                                sha256=file_sha256(legacy_path), **validators)
+                return 'unchanged'
+
+            if response.status_code == 206:
+                hasher = hash_file(hashlib.sha256(), part)
+                destination, mode = part, 'ab'
+            else:
+                if part and osp.exists(part):
+                    os.remove(part)
+                hasher = hashlib.sha256()
+                mode = 'wb'
+                offset = 0
+
+                def destination(head):
+                    path = osp.join(DEST, f'{cmt_id}{_guess_extension(head)}.part')
+                    manifest.update(cmt_id, link=vid_link, partial=dict(validators, path=path))
+                    return path
+
+            part, size = _save_response_content(response, destination, mode, hasher, progress)
+            size += offset
+        finally:
+            response.close()
+
+    if validators['content_length'] is not None and size != validators['content_length']:
+        raise IOError(f'incomplete download ({size} of {validators["content_length"]} bytes)')
+
+    target_filename = part[:-len('.part')]
+    digest = hasher.hexdigest()
+    with _finalize_lock:
+        os.replace(part, target_filename)
+        for old_path in (entry.get('path'), legacy_path):
+            if old_path and old_path != target_filename and osp.exists(old_path):
+                os.remove(old_path)
+
+        # Identical uploads (e.g. the same video submitted for two papers)
+        # share one copy on disk via a hard link.
+        original_id, original = manifest.find(digest, exclude=cmt_id)
+        duplicate_of = None
+        if original and osp.exists(original['path']) and not osp.samefile(original['path'], target_filename):
+            os.remove(target_filename)
+            try:
+                os.link(original['path'], target_filename)
+            except OSError:
+                shutil.copyfile(original['path'], target_filename)
+            duplicate_of = int(original_id)
 
+        manifest.update(cmt_id, link=vid_link, path=target_filename, size=size, sha256=digest,
+                        duplicate_of=duplicate_of, partial=None, **validators)
+    return 'downloaded' if duplicate_of is None else 'duplicate'
 
-def main(filename):
+
+@instrument.timed('download videos')
+def main(filename, workers=WORKERS, host_limits=None, revalidate=True):
 
     df = pd.read_csv(filename)
     if not osp.exists(DEST):
         os.mkdir(DEST)
 
-    existing_vids = set([int(osp.splitext(f)[0]) for f in os.listdir(DEST) if '.' in f])
-    print(existing_vids)
-    n_videos = len(df)
-    print(f'Processing {n_videos} files')
-    for i, (cmt_id, vid_link) in enumerate(zip(df[CMT_ID], df[VIDEO_LINK])):
-
-        if cmt_id in existing_vids:
-            print(f'Video #{cmt_id} already exists. Skipping.')
-            continue 
+    limits = dict(HOST_LIMITS, **(host_limits or {}))
+    host_slots = {host: threading.BoundedSemaphore(n) for host, n in limits.items()}
 
-        print(f'Downloading video ID={cmt_id:02d} [{i+1}/{n_videos}].')
-        try:
-            downloaded_file = download_file(vid_link)
-        except:
-            print(f'Couldn\'t download file from "{link}".')
-        else:
+    manifest = Manifest()
+    existing_vids = _existing_videos()
+    n_videos = len(df)
+    print(f'Processing {n_videos} files with {workers} workers')
+    progress = _Progress(n_videos)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for cmt_id, vid_link in zip(df[CMT_ID], df[VIDEO_LINK]):
+            if not isinstance(vid_link, str) or not vid_link.strip():
+                progress.skip()
+                continue
+            future = pool.submit(
+                _fetch, cmt_id, vid_link.strip(), host_slots, progress, manifest,
+                legacy_path=existing_vids.get(cmt_id), revalidate=revalidate)
+            futures[future] = (cmt_id, vid_link)
+
+        for future in as_completed(futures):
+            cmt_id, vid_link = futures[future]
             try:
-                ext = filetype.guess(downloaded_file)
-                ext = '' if ext is None else '.' + ext.extension
-                target_filename = osp.join(DEST, f'{cmt_id}{ext}')
-                shutil.move(downloaded_file, target_filename)
+                status = future.result()
             except Exception as err:
-                print(err)
-                print(f'Skipping cmt_id #{cmt_id}.')
+                tqdm.tqdm.write(f'Couldn\'t download video ID={cmt_id:02d} from "{vid_link}": {err!r}')
+                progress.finish('failed')
+            else:
+                progress.finish(status)
 
+    progress.summary()
 
-if __name__ == '__main__':
-    filename = sys.argv[1]
-    main(filename)
 
-    #print(download_from_gdrive('https://drive.google.com/file/d/1DhBvBblixq7kXnq6pUrcA_Q7msBlFVz0/view'))
-    #print(download_from_dropbox('https://www.dropbox.com/s/prbu9uhdr0w2tcs/OOL_2020.mp4?dl=0'))
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('filename', help='CSV with CMT ID and video link columns.')
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    parser.add_argument('--gdrive-workers', type=int, default=HOST_LIMITS['gdrive'])
+    parser.add_argument('--dropbox-workers', type=int, default=HOST_LIMITS['dropbox'])
+    parser.add_argument('--no-revalidate', dest='revalidate', action='store_false',
+                        help='Trust the manifest and skip videos already downloaded.')
+    args = parser.parse_args()
+    instrument.enable()
+    main(args.filename, workers=args.workers, host_limits={
+        'gdrive': args.gdrive_workers,
+        'dropbox': args.dropbox_workers,
+    }, revalidate=args.revalidate)
@@ -0,0 +1,207 @@
+"""Lightweight timing and HTTP instrumentation shared by the scripts.
+
+Scripts record into a process-wide registry:
+- `stage(name)` / `@timed(name)`: wall-clock time per pipeline stage;
+- `record_http(service, method, endpoint, status, seconds)`: a latency
+  histogram and status counts per endpoint (Zoom, video hosts, SMTP);
+- `count(name, n)`: totals such as downloaded bytes or sent emails,
+  reported with their rate over the time they were being recorded.
+
+Calling `enable()` in a script's `__main__` prints a summary table to
+stderr at exit. Set OOL_METRICS=path to also append the results as JSON
+lines, and OOL_PROFILE=path to run the whole script under cProfile
+(the stats are dumped to that path and the top functions printed).
+Before Python 3.12, cProfile only sees the thread that enables it, so
+every thread started afterwards (pipeline stages, download and Zoom/SMTP
+pools) gets its own profiler and the stats are merged at exit. From 3.12
+cProfile is built on sys.monitoring, sees all threads and allows only one
+active profiler, so a single one is used.
+"""
+
+import atexit
+import bisect
+import collections
+import contextlib
+import cProfile
+import functools
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+
+
+BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+_lock = threading.Lock()
+_stages = collections.OrderedDict()
+_http = {}
+_counters = {}
+_enabled = False
+_profilers = []
+
+
+def _normalize(endpoint):
+    """Collapses ids in a path so requests to the same endpoint are grouped."""
+    endpoint = endpoint.split("?", 1)[0]
+    endpoint = re.sub(r"/users/[^/]+/meetings", "/users/{id}/meetings", endpoint)
+    return re.sub(r"/\d+(?=/|$)", "/{id}", endpoint)
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Times the enclosed block as pipeline stage `name`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        with _lock:
+            total, calls = _stages.get(name, (0.0, 0))
+            _stages[name] = (total + seconds, calls + 1)
+
+
+def timed(name=None):
+    """Decorator version of `stage`, defaulting to the function's name."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name or fn.__name__):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_http(service, method, endpoint, status, seconds):
+    key = (service, method, _normalize(endpoint))
+    with _lock:
+        entry = _http.get(key)
+        if entry is None:
+            entry = _http[key] = {
+                "samples": [],
+                "statuses": collections.Counter(),
+                "buckets": [0] * (len(BUCKETS_MS) + 1),
+            }
+        entry["samples"].append(seconds)
+        entry["statuses"][str(status)] += 1
+        entry["buckets"][bisect.bisect_left(BUCKETS_MS, seconds * 1000)] += 1
+
+
+def count(name, n=1):
+    now = time.time()
+    with _lock:
+        entry = _counters.get(name)
+        if entry is None:
+            entry = _counters[name] = {"total": 0, "first": now, "last": now}
+        entry["total"] += n
+        entry["last"] = now
+
+
+def _percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+def results():
+    """Returns everything recorded so far as a list of JSON-able dicts."""
+    with _lock:
+        out = []
+        for name, (seconds, calls) in _stages.items():
+            out.append({"type": "stage", "name": name, "seconds": round(seconds, 4), "calls": calls})
+        for (service, method, endpoint), entry in sorted(_http.items()):
+            samples = entry["samples"]
+            errors = sum(n for status, n in entry["statuses"].items() if not status.startswith(("2", "3")))
+            out.append({
+                "type": "http",
+                "service": service,
+                "method": method,
+                "endpoint": endpoint,
+                "count": len(samples),
+                "error_rate": round(errors / len(samples), 4),
+                "statuses": dict(entry["statuses"]),
+                "p50_ms": round(_percentile(samples, 0.5) * 1000, 1),
+                "p95_ms": round(_percentile(samples, 0.95) * 1000, 1),
+                "max_ms": round(max(samples) * 1000, 1),
+                "histogram_ms": dict(zip([str(b) for b in BUCKETS_MS] + ["inf"], entry["buckets"])),
+            })
+        for name, entry in sorted(_counters.items()):
+            elapsed = entry["last"] - entry["first"]
+            out.append({
+                "type": "counter",
+                "name": name,
+                "total": entry["total"],
+                "per_second": round(entry["total"] / elapsed, 2) if elapsed > 0 else None,
+            })
+        return out
+
+
+def summary(file=sys.stderr):
+    """Prints the recorded results as a table."""
+    rows = results()
+    if not rows:
+        return
+    print("\n== Timings ==", file=file)
+    for row in rows:
+        if row["type"] == "stage":
+            print("{:<44} {:>9.3f}s  ({} calls)".format(row["name"], row["seconds"], row["calls"]), file=file)
+        elif row["type"] == "http":
+            statuses = " ".join("{}x{}".format(n, s) for s, n in sorted(row["statuses"].items()))
+            print("{:<44} {:>5} reqs  p50 {:>7.1f}ms  p95 {:>7.1f}ms  max {:>7.1f}ms  [{}]".format(
+                "{} {} {}".format(row["service"], row["method"], row["endpoint"]),
+                row["count"], row["p50_ms"], row["p95_ms"], row["max_ms"], statuses), file=file)
+        else:
+            rate = "" if row["per_second"] is None else "  ({:.2f}/s)".format(row["per_second"])
+            print("{:<44} {:>9}{}".format(row["name"], row["total"], rate), file=file)
+
+
+def _start_profiler():
+    profiler = cProfile.Profile()
+    with _lock:
+        _profilers.append(profiler)
+    profiler.enable()
+
+
+def _profile_thread(frame, event, arg):
+    # Installed by threading.setprofile (before 3.12 only), so this is the
+    # first event of a new thread: hand the thread over to its own profiler.
+    sys.setprofile(None)
+    _start_profiler()
+
+
+def _at_exit():
+    if _profilers:
+        if sys.version_info < (3, 12):
+            threading.setprofile(None)
+        main, workers = _profilers[0], _profilers[1:]
+        main.disable()
+        stats = pstats.Stats(main, stream=sys.stderr)
+        for profiler in workers:
+            stats.add(profiler)
+        path = os.environ["OOL_PROFILE"]
+        stats.dump_stats(path)
+        print("\n== cProfile (full stats in {}) ==".format(path), file=sys.stderr)
+        stats.sort_stats("cumulative").print_stats(20)
+
+    summary()
+    path = os.environ.get("OOL_METRICS")
+    if path:
+        script = os.path.basename(sys.argv[0])
+        now = time.time()
+        with open(path, "a") as fh:
+            for row in results():
+                fh.write(json.dumps(dict(row, script=script, time=now)) + "\n")
+
+
+def enable():
+    """Reports the collected metrics at exit; honours OOL_PROFILE and OOL_METRICS."""
+    global _enabled
+    if _enabled:
+        return
+    _enabled = True
+    if os.environ.get("OOL_PROFILE"):
+        if sys.version_info < (3, 12):
+            threading.setprofile(_profile_thread)
+        _start_profiler()
+    atexit.register(_at_exit)
@@ -1,12 +1,23 @@
 import yaml
+import hashlib
+import json
 import os
-import pandas as pd
 import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
 
-from utils import load_presentation_data, read_meeting_json, meeting_json_exists
+from utils import load_presentation_data, load_meeting_jsons, write_json_atomic
+from pdf_previews import load_pdf_index
+from search_index import SEARCH_INDEX, write_search_index
+from render_pages import render_pages
+from optimize_images import load_image_index, speaker_photo
+import instrument
 
 
 INCLUDE_MEETING_URLS = True
+# Write finished HTML (see render_pages.py) instead of stubs for Jekyll's layouts.
+RENDER_PAGES = os.environ.get("OOL_RENDER_PAGES", "") == "1"
+PROGRAM_MANIFEST = "scripts/data/.cache/program_manifest.json"
 TEMPLATE = """
 ---
 layout: paper
@@ -26,10 +37,26 @@ track: {track}
 live: {live}
 video_file_url: {video_file_url}
 youtube_url: {youtube_url}
+pdf_pages: {pdf_pages}
+pdf_thumbnail: {pdf_thumbnail}
 ---
 """.strip()
 
 
+KIND_ORDER = ["oral", "spotlight", "poster"]
+# libyaml when available. It wraps long non-ASCII strings differently from
+# the pure-Python dumper, so the two don't produce byte-identical files.
+_YAML_DUMPER = getattr(yaml, "CDumper", yaml.Dumper)
+
+
+def _kind_order(kind):
+    """Sorts the known kinds first, in `KIND_ORDER`, then any others by name."""
+    if kind in KIND_ORDER:
+        return (KIND_ORDER.index(kind), "")
+    return (len(KIND_ORDER), kind)
+
+
+@instrument.timed()
 def make_jekyll_data():
     data = load_presentation_data()
     data = data.sort_values(by="authors")
@@ -44,28 +71,30 @@ def make_jekyll_data():
         "live",
     ])
 
-    # Process sessions.
+    # Process sessions, in one sorted pass: by session, then kind, then
+    # authors (the frame is already sorted by authors, so sort stably).
+    papers = data[data["session"] > 0].copy()
+    kinds = sorted(papers["kind"].unique(), key=_kind_order)
+    papers["kind_rank"] = papers["kind"].map({kind: i for i, kind in enumerate(kinds)}).astype(int)
+    papers = papers.sort_values(by=["session", "kind_rank"], kind="stable")
+
     sessions = []
-    for session in [1, 2]:
-        session_data = data.query("session == {}".format(session))
+    for session, session_data in papers.groupby("session", sort=True):
         session_title, = session_data["session_title"].unique()
-        session_data = pd.concat([
-            session_data.query("kind == 'oral'"),
-            session_data.query("kind == 'spotlight'"),
-            session_data.query("kind == 'poster'"),
-        ])
         session_data = session_data.drop(columns=[
+            "kind_rank",
             "session_title",
             "video_file_url",
             "youtube_url",
         ])
         sessions.append({
-            "id": session,
+            "id": int(session),
             "title": session_title,
             "papers": session_data.to_dict(orient="records")
         })
     with open("_data/sessions.yml", "w") as fh:
-        yaml.dump(sessions, fh)
+        yaml.dump(sessions, fh, Dumper=_YAML_DUMPER)
+    write_search_index(papers[["id", "title", "abstract", "authors"]].to_dict(orient="records"), SEARCH_INDEX)
 
     # Process speakers.
     speakers = data.query("session == 0")
@@ -80,27 +109,89 @@ def make_jekyll_data():
         "youtube_url",
     ])
     speakers = speakers.to_dict(orient="records")
+    images = load_image_index()
+    for speaker in speakers:
+        photo = speaker_photo(speaker["authors"], images)
+        if photo is not None:
+            speaker["photo"] = {key: photo[key] for key in ["width", "height", "src", "srcset", "sources"]}
     with open("_data/speakers.yml", "w") as fh:
-        yaml.dump(speakers, fh)
+        yaml.dump(speakers, fh, Dumper=_YAML_DUMPER)
+
+
+def _read_manifest():
+    if os.path.exists(PROGRAM_MANIFEST):
+        with open(PROGRAM_MANIFEST, "r") as fh:
+            return json.load(fh)
+    return {}
+
+
+def _file_state(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
 
+def _page_unchanged(path, digest, manifest):
+    """Whether `path` on disk already holds content with `digest`."""
+    if not os.path.exists(path):
+        return False
+    entry = manifest.get(path)
+    if entry and entry["state"] == _file_state(path):
+        return entry["sha256"] == digest
+    # Unknown or touched since the last build; compare the content itself.
+    with open(path, "rb") as fh:
+        return hashlib.sha256(fh.read()).hexdigest() == digest
 
-def make_program():
-    # Delete existing files.
-    files = os.listdir("program")
-    for file in files:
-        os.remove(os.path.join("program", file))
 
+def write_pages(pages, directory="program"):
+    """Writes `pages` (path -> text), touching only files whose content changed.
+
+    Files in `directory` that are not in `pages` are deleted. Unchanged
+    files keep their mtime, so Jekyll's incremental build and the deploy
+    skip them.
+    """
+    manifest = _read_manifest()
+    new_manifest = {}
+    written = unchanged = 0
+    for path, text in pages.items():
+        content = text.encode("utf-8")
+        digest = hashlib.sha256(content).hexdigest()
+        if _page_unchanged(path, digest, manifest):
+            unchanged += 1
+        else:
+            with open(path + ".tmp", "wb") as fh:
+                fh.write(content)
+            os.replace(path + ".tmp", path)
+            written += 1
+        new_manifest[path] = {"sha256": digest, "state": _file_state(path)}
+
+    removed = 0
+    for file in os.listdir(directory):
+        path = os.path.join(directory, file)
+        if path not in pages:
+            os.remove(path)
+            removed += 1
+
+    other = {k: v for k, v in manifest.items() if not k.startswith(directory + "/")}
+    write_json_atomic(PROGRAM_MANIFEST, dict(other, **new_manifest), indent=1, sort_keys=True)
+    print("{}: {} written, {} unchanged, {} removed".format(
+        directory, written, unchanged, removed))
+
+
+@instrument.timed()
+def make_program(render=None):
+    if render is None:
+        render = RENDER_PAGES
     all_data = load_presentation_data().to_dict(orient="records")
+    meetings = load_meeting_jsons("OOL") if INCLUDE_MEETING_URLS else {}
+    pdfs = load_pdf_index()
+    pages = {}
     for data in all_data:
-        print(data["unique_id"])
-
         if INCLUDE_MEETING_URLS:
-            meeting_id = "OOL_{}".format(data["unique_id"])
-            if meeting_json_exists(meeting_id):
-                meeting = read_meeting_json(meeting_id)
+            meeting = meetings.get(str(data["unique_id"]))
+            if meeting is not None:
                 data["meeting_url"] = meeting["join_url"]
             else:
-                print("No meeting '{}'".format(meeting_id))
+                print("No meeting 'OOL_{}'".format(data["unique_id"]))
                 data["meeting_url"] = ""
         else:
             data["meeting_url"] = ""
@@ -110,46 +201,138 @@ def make_program():
         data["abstract"] = data["abstract"]
         data["live"] = str(data["live"]).lower()
 
+        pdf = pdfs.get(str(data["unique_id"]), {})
+        data["pdf_pages"] = pdf.get("pages", "")
+        data["pdf_thumbnail"] = "/" + pdf["thumbnail"] if pdf else ""
+
         data["rocket_id"] = "ool-paper-{:d}".format(data["unique_id"])
         if data["kind"] == "opening":
             data["rocket_id"] = "object-oriented-learning-perception-representation-and-reasoning-11"
 
-        html = TEMPLATE.format(**data)
         path = "program/ool_{}.html".format(data["unique_id"])
-        assert not os.path.exists(path)
-        with open(path, "w") as fh:
-            fh.write(html)
+        assert path not in pages
+        pages[path] = TEMPLATE.format(**data)
+
+    if render:
+        with instrument.stage("render program pages"):
+            pages = render_pages(pages)
+    write_pages(pages, "program")
+
 
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
 
+
+def _yaml_scalar(value):
+    """Formats `value` the way `TEMPLATE` writes front-matter values."""
+    if value is None or value == "":
+        return ""
+    if isinstance(value, bool):
+        return str(value).lower()
+    if isinstance(value, (int, float)):
+        return str(value)
+    value = str(value)
+    if "\n" not in value and yaml.load(value, Loader=_YAML_LOADER) == value:
+        return value
+    return json.dumps(value)
+
+
+def _split_front_matter(text):
+    """Returns the (start, end) offsets of the YAML header inside `text`."""
+    if not text.startswith("---"):
+        raise ValueError("no front matter")
+    start = text.index("\n") + 1
+    end = text.index("\n---", start - 1) + 1
+    return start, end
+
+
+def _patch_header(header, fields):
+    """Replaces the values of top-level `fields` in the YAML `header`."""
+    try:
+        node = yaml.compose(header, Loader=_YAML_LOADER)
+    except yaml.YAMLError:
+        node = None
+
+    spans = {}
+    if node is not None:
+        for key, value in node.value:
+            if key.value in fields:
+                start = header.index(":", key.end_mark.index) + 1
+                end = value.end_mark.index
+                if value.start_mark.index == end:
+                    # Empty value, e.g. "meeting_url: "; replace up to the
+                    # end of the line.
+                    end = header.index("\n", start)
+                spans[key.value] = (start, end)
+    else:
+        # Not valid YAML (e.g. an unescaped quote in an abstract); only
+        # trust keys at the start of a line.
+        for match in re.finditer(r"^([A-Za-z_]+):(.*)$", header, re.M):
+            if match.group(1) in fields and match.group(1) not in spans:
+                spans[match.group(1)] = match.span(2)
+
+    missing = [key for key in fields if key not in spans]
+    for key, (start, end) in sorted(spans.items(), key=lambda x: -x[1][0]):
+        header = header[:start] + " " + _yaml_scalar(fields[key]) + header[end:]
+    for key in missing:
+        header += "{}: {}\n".format(key, _yaml_scalar(fields[key]))
+    return header
+
+
+def update_front_matter(path, fields):
+    """Sets `fields` in the front matter of `path`; returns whether it changed.
+
+    Only the YAML header is parsed and the body is left untouched. The
+    file is not rewritten if the values are already up to date.
+    """
+    with open(path, "r") as fh:
+        text = fh.read()
+    start, end = _split_front_matter(text)
+    header = _patch_header(text[start:end], fields)
+    if header == text[start:end]:
+        return False
+
+    with open(path + ".tmp", "w") as fh:
+        fh.write(text[:start] + header + text[end:])
+    os.replace(path + ".tmp", path)
+    return True
+
+
+def update_front_matter_many(updates, workers=8):
+    """Applies `updates` (path -> fields) concurrently; returns the changed paths."""
+    paths = list(updates)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        changed = pool.map(lambda path: update_front_matter(path, updates[path]), paths)
+        changed = [path for path, c in zip(paths, changed) if c]
+    print("Updated front matter of {} of {} pages".format(len(changed), len(paths)))
+    return changed
+
+
+@instrument.timed()
 def add_zoom_links():
+    if RENDER_PAGES:
+        # Rendered pages have no front matter to patch; rebuilding only
+        # rewrites the pages whose meeting URL changed.
+        make_program(render=True)
+        return
     all_data = load_presentation_data().to_dict(orient="records")
+    meetings = load_meeting_jsons("OOL") if INCLUDE_MEETING_URLS else {}
+    updates = {}
     for data in all_data:
-        print(data["unique_id"])
-
+        meeting_url = ""
         if INCLUDE_MEETING_URLS:
-            meeting_id = "OOL_{}".format(data["unique_id"])
-            if meeting_json_exists(meeting_id):
-                meeting = read_meeting_json(meeting_id)
-                data["meeting_url"] = meeting["join_url"]
+            meeting = meetings.get(str(data["unique_id"]))
+            if meeting is not None:
+                meeting_url = meeting["join_url"]
             else:
-                print("No meeting '{}'".format(meeting_id))
-                data["meeting_url"] = ""
-        else:
-            data["meeting_url"] = ""
+                print("No meeting 'OOL_{}'".format(data["unique_id"]))
 
         path = "program/ool_{}.html".format(data["unique_id"])
-        with open(path, "r") as fh:
-            html = fh.read()
-
-        pattern = r"meeting_url: .*"
-        repl = r"meeting_url: {}".format(data["meeting_url"])
-        html = re.sub(pattern, repl, html)
+        updates[path] = {"meeting_url": meeting_url}
 
-        with open(path, "w") as fh:
-            fh.write(html)
+    update_front_matter_many(updates)
 
 
 if __name__ == "__main__":
-    # make_jekyll_data()
-    # make_program()
-    add_zoom_links()
+    # Rebuilds only what changed; see `python scripts/pipeline.py --list`.
+    import pipeline
+    sys.exit(pipeline.main())
@@ -0,0 +1,253 @@
+"""Forms meet-and-greet groups from individual sign-ups.
+
+Usage:
+    python scripts/meet_and_greet.py signups.csv [--details scripts/data/meet_and_greet_details.csv]
+        [--output scripts/data/meet_and_greet.csv] [--seed 0]
+
+`signups.csv` has one row per person and timeslot (name, email,
+timeslot). The details CSV is the one `load_meet_and_greet_data` reads,
+optionally with an `interests` column (tags separated by commas or
+semicolons). The groups are written as `meet_and_greet.csv` (timeslot,
+name_1..4, email_1..4), so `load_meet_and_greet_data` and everything
+downstream work unchanged.
+
+Every timeslot is split into groups of 2-4 people:
+- seniority is balanced by dealing people into groups in a snake draft,
+  most senior first, which fixes how many of each level a group gets;
+- within a level, people are placed greedily in the group whose members'
+  interests are most similar to theirs (cosine similarity of hashed
+  interest vectors, one small matrix-vector product per person over up to
+  `CANDIDATE_GROUPS` open groups), avoiding groups that already have
+  someone from their institution; clashes the greedy pass can't avoid
+  are then undone by swapping people of the same level between groups.
+  When one institution is too big to spread out, its leftover clashes
+  are given up on after one failed search rather than retried.
+"""
+
+import argparse
+import collections
+import re
+import zlib
+
+import numpy as np
+import pandas as pd
+
+import instrument
+from utils import load_meet_and_greet_data
+
+
+SIGNUPS_CSV = "scripts/data/meet_and_greet_signups.csv"
+DETAILS_CSV = "scripts/data/meet_and_greet_details.csv"
+GROUPS_CSV = "scripts/data/meet_and_greet.csv"
+MAX_GROUP_SIZE = 4
+INTEREST_DIMS = 64
+CANDIDATE_GROUPS = 256
+# Checked in order against the lower-cased academic_status; unknown is in the middle.
+SENIORITY = [
+    (r"professor|faculty|lecturer|principal|head|director", 3),
+    (r"postdoc|post-doc|scientist|researcher|engineer|industry", 2),
+    (r"phd|student|master|msc|undergrad|intern", 1),
+]
+UNKNOWN_SENIORITY = 2
+
+
+def seniority(status):
+    status = str(status).lower()
+    for pattern, level in SENIORITY:
+        if re.search(pattern, status):
+            return level
+    return UNKNOWN_SENIORITY
+
+
+def _interest_vectors(interests):
+    """Hashes each person's interest tags into unit vectors of `INTEREST_DIMS`."""
+    rows, cols = [], []
+    for i, tags in enumerate(interests):
+        for tag in re.split(r"[,;]", str(tags).lower()):
+            tag = " ".join(tag.split())
+            if tag:
+                rows.append(i)
+                cols.append(zlib.crc32(tag.encode("utf-8")) % INTEREST_DIMS)
+    vectors = np.zeros((len(interests), INTEREST_DIMS))
+    np.add.at(vectors, (rows, cols), 1.0)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=vectors, where=norms > 0)
+
+
+def _group_sizes(n):
+    """Splits `n` people into as few groups of 2-4 as possible, sizes differing by at most one."""
+    if n < 2:
+        return []
+    k = -(-n // MAX_GROUP_SIZE)
+    return [n // k + (1 if g < n % k else 0) for g in range(k)]
+
+
+def _snake_quotas(sizes, levels):
+    """Returns quota[group, level]: how many of each seniority level each group gets."""
+    slots = []
+    for r in range(max(sizes)):
+        round_groups = [g for g, size in enumerate(sizes) if size > r]
+        slots.extend(round_groups if r % 2 == 0 else round_groups[::-1])
+    quota = np.zeros((len(sizes), levels.max() + 1), dtype=int)
+    np.add.at(quota, (np.array(slots), np.sort(levels)[::-1]), 1)
+    return quota
+
+
+def _form_slot_groups(people, rng):
+    """Groups the people of one timeslot; returns (list of index arrays, clashes)."""
+    sizes = _group_sizes(len(people))
+    if not sizes:
+        return [], 0
+    levels = people["seniority"].to_numpy()
+    institutions = people["institution"].to_numpy()
+    vectors = _interest_vectors(people["interests"].to_numpy())
+
+    quota = _snake_quotas(sizes, levels)
+    centroids = np.zeros((len(sizes), INTEREST_DIMS))
+    norms = np.ones(len(sizes))
+    members = [[] for _ in sizes]
+    groups_by_institution = collections.defaultdict(set)
+    clashes = 0
+
+    for level in sorted(set(levels), reverse=True):
+        # Groups that still take people of this level, in random order; each
+        # person only considers the first CANDIDATE_GROUPS, which keeps a
+        # placement O(1) however many groups there are.
+        pool = rng.permutation(np.flatnonzero(quota[:, level] > 0))
+        # Institutions already in every group left in `pool`; as the pool only
+        # shrinks, they stay that way for the rest of the level.
+        saturated = set()
+        for i in rng.permutation(np.flatnonzero(levels == level)):
+            institution = institutions[i]
+            taken = groups_by_institution[institution] if institution else ()
+            candidates = pool[:CANDIDATE_GROUPS]
+            if taken:
+                if len(taken) < CANDIDATE_GROUPS // 8:
+                    open_candidates = candidates[~np.isin(candidates, list(taken))]
+                else:  # a big institution: set lookups beat np.isin's sort
+                    open_candidates = candidates[[g not in taken for g in candidates.tolist()]]
+                if not len(open_candidates) and institution not in saturated:
+                    rest = pool[CANDIDATE_GROUPS:]
+                    open_candidates = rest[~np.isin(rest, np.fromiter(taken, int, len(taken)))]
+                    if not len(open_candidates):
+                        saturated.add(institution)
+                if len(open_candidates):
+                    candidates = open_candidates
+                else:
+                    clashes += 1
+            score = centroids[candidates] @ vectors[i] / norms[candidates]
+            g = candidates[int(np.argmax(score))]
+
+            quota[g, level] -= 1
+            if not quota[g, level]:
+                pool = pool[pool != g]
+            centroids[g] += vectors[i]
+            norms[g] = max(np.linalg.norm(centroids[g]), 1e-9)
+            members[g].append(i)
+            if institution:
+                groups_by_institution[institution].add(int(g))
+    if clashes:
+        clashes = _repair_clashes(members, levels, institutions, rng)
+    return [np.array(m) for m in members], clashes
+
+
+def _repair_clashes(members, levels, institutions, rng):
+    """Swaps people of the same level between groups to undo institution clashes.
+
+    The greedy pass can paint itself into a corner; this fixes what it can
+    without touching the seniority balance. Partners are looked up by
+    (level, institution), and a (level, institution) whose search found no
+    partner isn't searched again, so unavoidable clashes cost one pass.
+    Returns the clashes left.
+    """
+    group_of = np.empty(len(levels), dtype=int)
+    counts = []
+    for g, group in enumerate(members):
+        group_of[group] = g
+        counts.append(collections.Counter(institutions[i] for i in group if institutions[i]))
+    # People of each level, bucketed by institution, buckets in random order.
+    buckets = collections.defaultdict(lambda: collections.defaultdict(list))
+    for j in rng.permutation(len(levels)):
+        buckets[levels[j]][institutions[j]].append(j)
+    hopeless = set()
+
+    for g, group in enumerate(members):
+        for i in list(group):
+            a, level = institutions[i], levels[i]
+            if not a or counts[g][a] < 2 or (level, a) in hopeless:
+                continue
+            partner = None
+            for b, people in buckets[level].items():
+                if b == a or (b and counts[g][b]):
+                    continue
+                partner = next((j for j in people if not counts[group_of[j]][a]), None)
+                if partner is not None:
+                    break
+            if partner is None:
+                hopeless.add((level, a))
+                continue
+            j = partner
+            h, b = group_of[j], institutions[j]
+            members[g][members[g].index(i)] = j
+            members[h][members[h].index(j)] = i
+            group_of[i], group_of[j] = h, g
+            counts[g][a] -= 1
+            counts[h][a] += 1
+            if b:
+                counts[h][b] -= 1
+                counts[g][b] += 1
+    return sum(n - 1 for count in counts for n in count.values() if n > 1)
+
+
+@instrument.timed()
+def form_groups(signups, details, seed=0):
+    """Returns the groups as a frame with meet_and_greet.csv's columns."""
+    signups = signups.fillna("").drop_duplicates(subset=["email", "timeslot"])
+    details = details.fillna("").drop_duplicates(subset="email")
+    if "interests" not in details:
+        details = details.assign(interests="")
+    people = signups.merge(
+        details[["email", "institution", "academic_status", "interests"]], on="email", how="left")
+    people = people.fillna("")
+    people["institution"] = people["institution"].str.strip().str.lower()
+    people["seniority"] = people["academic_status"].map(seniority)
+
+    rng = np.random.default_rng(seed)
+    rows = []
+    for timeslot, slot_people in people.groupby("timeslot", sort=False):
+        slot_people = slot_people.reset_index(drop=True)
+        groups, clashes = _form_slot_groups(slot_people, rng)
+        names = slot_people["name"].to_numpy()
+        emails = slot_people["email"].to_numpy()
+        for group in groups:
+            row = {"timeslot": timeslot}
+            for j in range(1, MAX_GROUP_SIZE + 1):
+                row["name_{}".format(j)] = names[group[j - 1]] if j <= len(group) else ""
+                row["email_{}".format(j)] = emails[group[j - 1]] if j <= len(group) else ""
+            rows.append(row)
+        print("{}: {} people in {} groups, {} same-institution placements{}".format(
+            timeslot, len(slot_people), len(groups), clashes,
+            "" if groups else " (not enough people to form a group)"))
+
+    columns = ["timeslot"] + ["{}_{}".format(key, j)
+                              for j in range(1, MAX_GROUP_SIZE + 1) for key in ["name", "email"]]
+    return pd.DataFrame(rows, columns=columns)
+
+
+def make_meet_and_greet_groups(signups_path=SIGNUPS_CSV, details_path=DETAILS_CSV,
+                               output_path=GROUPS_CSV, seed=0):
+    """Writes the groups to `output_path` and returns them as `load_meet_and_greet_data` does."""
+    groups = form_groups(pd.read_csv(signups_path), pd.read_csv(details_path), seed=seed)
+    groups.to_csv(output_path, index=False)
+    return load_meet_and_greet_data(output_path, details_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("signups", nargs="?", default=SIGNUPS_CSV)
+    parser.add_argument("--details", default=DETAILS_CSV)
+    parser.add_argument("--output", default=GROUPS_CSV)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    instrument.enable()
+    make_meet_and_greet_groups(args.signups, args.details, args.output, args.seed)
@@ -0,0 +1,209 @@
+"""A local stand-in for the parts of the Zoom API that `zoom.py` uses.
+
+Run it, then point `zoom.py` at it instead of api.zoom.us:
+
+    python scripts/mock_zoom.py --port 8000 --users 50 --latency 0.05 --error-rate 0.01
+    ZOOM_API_URL=http://localhost:8000/v2 python scripts/zoom.py --workers 16
+
+Implements:
+- GET /users (paginated with page_size/page_number)
+- POST /users/{id}/meetings
+- GET/PATCH /meetings/{id}
+
+and can simulate latency, a per-second rate limit (429 with Retry-After),
+the daily meeting-creation cap and random 5xx errors. State is kept in
+memory; request counts are printed on exit (Ctrl-C).
+"""
+
+import argparse
+import collections
+import hashlib
+import http.server
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+
+
+class MockZoom:
+	"""In-memory Zoom account with the configured failure modes."""
+
+	def __init__(self, n_users=30, user_email_template="host+{}@example.com",
+				 latency=0.0, rate=10, daily_meeting_limit=100, error_rate=0.0, seed=0):
+		self.latency = latency
+		self.rate = rate
+		self.daily_meeting_limit = daily_meeting_limit
+		self.error_rate = error_rate
+		self.random = random.Random(seed)
+		self.users = [
+			{
+				"id": "mockuser{:05d}".format(i),
+				"email": user_email_template.format(i),
+				"type": 2,
+				"status": "active",
+			}
+			for i in range(n_users + 1)
+		]
+		self.meetings = {}
+		self.meetings_created = 0
+		self.counters = collections.Counter()
+		self._next_id = 90000000000
+		self._window = collections.deque()
+		self._lock = threading.Lock()
+
+	def _rate_limited(self):
+		now = time.monotonic()
+		with self._lock:
+			while self._window and now - self._window[0] >= 1:
+				self._window.popleft()
+			if self.rate and len(self._window) >= self.rate:
+				return True
+			self._window.append(now)
+			return False
+
+	def handle(self, method, path, query, body):
+		"""Returns (status, headers, payload) for a request."""
+		if self.latency:
+			time.sleep(self.random.expovariate(1 / self.latency))
+		if self._rate_limited():
+			return 429, {"Retry-After": "1", "X-RateLimit-Type": "QPS"}, {
+				"code": 429, "message": "You have reached the maximum per-second rate limit."}
+		if self.error_rate and self.random.random() < self.error_rate:
+			return 503, {}, {"code": 503, "message": "Simulated server error."}
+
+		path = re.sub(r"^/v2", "", path)
+		if method == "GET" and path == "/users":
+			return self.list_users(query)
+		match = re.match(r"^/users/([^/]+)/meetings$", path)
+		if method == "POST" and match:
+			return self.create_meeting(match.group(1), body)
+		match = re.match(r"^/meetings/(\d+)$", path)
+		if match and method == "GET":
+			return self.get_meeting(int(match.group(1)))
+		if match and method == "PATCH":
+			return self.update_meeting(int(match.group(1)), body)
+		return 404, {}, {"code": 404, "message": "No such endpoint."}
+
+	def list_users(self, query):
+		page_size = min(int(query.get("page_size", 30)), 300)
+		page_number = int(query.get("page_number", 1))
+		page_count = max(1, -(-len(self.users) // page_size))
+		start = (page_number - 1) * page_size
+		return 200, {}, {
+			"page_count": page_count,
+			"page_number": page_number,
+			"page_size": page_size,
+			"total_records": len(self.users),
+			"users": self.users[start:start + page_size],
+		}
+
+	def create_meeting(self, user_id, body):
+		host = next((user for user in self.users if user["id"] == user_id), None)
+		if host is None:
+			return 404, {}, {"code": 1001, "message": "User does not exist: {}.".format(user_id)}
+		with self._lock:
+			if self.meetings_created >= self.daily_meeting_limit:
+				return 429, {"Retry-After": str(24 * 60 * 60), "X-RateLimit-Type": "Daily"}, {
+					"code": 429, "message": "You have reached the maximum daily meeting limit."}
+			self.meetings_created += 1
+			self._next_id += 1
+			meeting_id = self._next_id
+
+		meeting = dict(body, id=meeting_id, host_id=user_id, host_email=host["email"],
+					   uuid="mock{}".format(meeting_id))
+		meeting["settings"] = dict(body.get("settings", {}))
+		self._set_urls(meeting)
+		self.meetings[meeting_id] = meeting
+		return 201, {}, meeting
+
+	def get_meeting(self, meeting_id):
+		if meeting_id not in self.meetings:
+			return 404, {}, {"code": 3001, "message": "Meeting does not exist."}
+		return 200, {}, self.meetings[meeting_id]
+
+	def update_meeting(self, meeting_id, body):
+		if meeting_id not in self.meetings:
+			return 404, {}, {"code": 3001, "message": "Meeting does not exist."}
+		meeting = self.meetings[meeting_id]
+		for key, value in body.items():
+			if key == "settings":
+				meeting["settings"].update(value)
+			else:
+				meeting[key] = value
+		self._set_urls(meeting)
+		return 204, {}, None
+
+	def _set_urls(self, meeting):
+		pwd = hashlib.sha1(str(meeting.get("password", "")).encode()).hexdigest()[:16]
+		meeting["join_url"] = "https://zoom.us/j/{}?pwd={}".format(meeting["id"], pwd)
+		meeting["start_url"] = "https://zoom.us/s/{}?zak=mock".format(meeting["id"])
+
+
+def make_handler(zoom):
+	class Handler(http.server.BaseHTTPRequestHandler):
+
+		def log_message(self, *args):
+			pass
+
+		def _handle(self, method):
+			path, _, query = self.path.partition("?")
+			query = dict(urllib.parse.parse_qsl(query))
+			length = int(self.headers.get("Content-Length") or 0)
+			body = json.loads(self.rfile.read(length)) if length else {}
+
+			status, headers, payload = zoom.handle(method, path, query, body)
+			zoom.counters["{} {}".format(method, status)] += 1
+
+			data = json.dumps(payload).encode() if payload is not None else b""
+			self.send_response(status)
+			for key, value in headers.items():
+				self.send_header(key, value)
+			self.send_header("Content-Type", "application/json")
+			self.send_header("Content-Length", str(len(data)))
+			self.end_headers()
+			self.wfile.write(data)
+
+		def do_GET(self):
+			self._handle("GET")
+
+		def do_POST(self):
+			self._handle("POST")
+
+		def do_PATCH(self):
+			self._handle("PATCH")
+
+	return Handler
+
+
+def serve(zoom, host="localhost", port=8000):
+	server = http.server.ThreadingHTTPServer((host, port), make_handler(zoom))
+	print("Mock Zoom API on http://{}:{}/v2".format(host, port))
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		print(", ".join("{}: {}".format(k, v) for k, v in sorted(zoom.counters.items())))
+		print("{} meetings created".format(zoom.meetings_created))
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--host", default="localhost")
+	parser.add_argument("--port", type=int, default=8000)
+	parser.add_argument("--users", type=int, default=30, help="number of host users")
+	parser.add_argument("--user-email-template", default="host+{}@example.com",
+						help="should match USER_EMAIL_TEMPLATE in secret.py")
+	parser.add_argument("--latency", type=float, default=0.0, help="mean latency in seconds")
+	parser.add_argument("--rate", type=int, default=10, help="requests per second before 429s (0 = no limit)")
+	parser.add_argument("--daily-meeting-limit", type=int, default=100)
+	parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests failing with 503")
+	parser.add_argument("--seed", type=int, default=0)
+	args = parser.parse_args()
+	serve(MockZoom(
+		n_users=args.users, user_email_template=args.user_email_template,
+		latency=args.latency, rate=args.rate, daily_meeting_limit=args.daily_meeting_limit,
+		error_rate=args.error_rate, seed=args.seed), args.host, args.port)
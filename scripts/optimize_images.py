@@ -0,0 +1,167 @@
+"""Makes resized, metadata-free variants of the images in images/ for srcset.
+
+Usage:
+    python scripts/optimize_images.py [--workers 4]
+
+Every JPEG/PNG in `images/` is resized to each of `WIDTHS` (never
+upscaled) and saved in `images/optimized/` as AVIF and WebP, where
+Pillow supports them, plus a JPEG fallback (PNG for images with
+transparency). The work runs in a process pool with Pillow
+(`pip install pillow`). EXIF orientation is applied and all metadata is
+dropped. Variant names carry the first 8 hex digits of the source's
+SHA-256, so unchanged images are never re-encoded and browsers never see
+a stale file; variants of replaced images are removed. SVGs are left as
+they are.
+
+`IMAGE_INDEX` maps each image (by file stem, e.g. "kipf") to its size, a
+`<source>` per modern format and the fallback's `src`/`srcset`;
+`make_jekyll_data` adds that as `photo` to the speaker records in
+`_data/speakers.yml`, and `_includes/speaker_photo.html` renders it as a
+`<picture>` on the speakers page.
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+from concurrent.futures import as_completed
+
+import instrument
+from utils import file_sha256, process_pool, write_json_atomic
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:
+    Image = None
+
+
+IMAGES_DIR = "images"
+OPTIMIZED_DIR = "images/optimized"
+IMAGE_INDEX = "scripts/data/.cache/images.json"
+IMAGE_PATTERNS = ["*.jpg", "*.jpeg", "*.png"]
+WIDTHS = [150, 300, 600]
+# Tried in this order when Pillow was built with them; JPEG or PNG is always added.
+MODERN_FORMATS = ["avif", "webp"]
+MIME_TYPES = {"avif": "image/avif", "webp": "image/webp"}
+SAVE_FORMATS = {"avif": "AVIF", "webp": "WEBP", "jpg": "JPEG", "png": "PNG"}
+QUALITY = {"avif": 60, "webp": 80, "jpg": 82}
+WORKERS = os.cpu_count() or 4
+
+
+def _supported(fmt):
+    try:
+        return features.check_module(fmt)
+    except ValueError:  # a Pillow too old to know the format
+        return False
+
+
+def _variant_path(stem, digest, width, ext):
+    return os.path.join(OPTIMIZED_DIR, "{}-{}-{}.{}".format(stem, digest[:8], width, ext))
+
+
+def _optimize(path, digest):
+    """Runs in a worker: writes the missing variants of `path`; returns its index entry."""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    with Image.open(path) as original:
+        image = ImageOps.exif_transpose(original)
+        rgba = image.convert("RGBA")
+        has_alpha = rgba.getextrema()[3][0] < 255
+        image = rgba if has_alpha else image.convert("RGB")
+        fallback = "png" if has_alpha else "jpg"
+        formats = [fmt for fmt in MODERN_FORMATS if _supported(fmt)] + [fallback]
+
+        widths = [w for w in WIDTHS if w < image.width] + [min(image.width, max(WIDTHS))]
+        variants = {fmt: [] for fmt in formats}
+        for width in sorted(set(widths)):
+            height = round(image.height * width / image.width)
+            resized = None
+            for fmt in formats:
+                target = _variant_path(stem, digest, width, fmt)
+                if not os.path.exists(target):
+                    if resized is None:
+                        resized = image.resize((width, height), Image.LANCZOS)
+                        # convert() and resize() copy `info`, and the encoders
+                        # fall back to its exif/icc_profile; drop all of it.
+                        resized.info = {}
+                    options = {"optimize": True}
+                    if fmt in QUALITY:
+                        options["quality"] = QUALITY[fmt]
+                    if fmt == "jpg":
+                        options["progressive"] = True
+                    resized.save(target + ".tmp", format=SAVE_FORMATS[fmt], **options)
+                    os.replace(target + ".tmp", target)
+                variants[fmt].append((width, target))
+        srcset = {fmt: ", ".join("/{} {}w".format(target, width) for width, target in items)
+                  for fmt, items in variants.items()}
+        return {
+            "sha256": digest,
+            "width": image.width,
+            "height": image.height,
+            "src": "/" + variants[fallback][0][1],
+            "srcset": srcset[fallback],
+            "sources": [{"type": MIME_TYPES[fmt], "srcset": srcset[fmt]}
+                        for fmt in formats if fmt != fallback],
+        }
+
+
+@instrument.timed()
+def optimize_images(workers=WORKERS):
+    """Brings `images/optimized` and `IMAGE_INDEX` up to date; returns the index."""
+    if Image is None:
+        # Keep the last index, so the pipeline sees its output and the
+        # speakers keep the photos that were already optimized.
+        print("Pillow is not installed; skipping image optimization")
+        index = load_image_index()
+        write_json_atomic(IMAGE_INDEX, index, indent=1, sort_keys=True)
+        return index
+    if not os.path.exists(OPTIMIZED_DIR):
+        os.makedirs(OPTIMIZED_DIR)
+
+    sources = sorted(set(path for pattern in IMAGE_PATTERNS
+                         for path in glob.glob(os.path.join(IMAGES_DIR, pattern))))
+    index = {}
+    with process_pool(workers) as pool:
+        futures = {pool.submit(_optimize, path, file_sha256(path)): path for path in sources}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                index[os.path.splitext(os.path.basename(path))[0]] = future.result()
+            except Exception as err:
+                print("Couldn't optimize {}: {!r}".format(path, err))
+
+    # Variants of images that were replaced or deleted.
+    current = {"{}-{}".format(stem, entry["sha256"][:8]) for stem, entry in index.items()}
+    removed = 0
+    for file in os.listdir(OPTIMIZED_DIR):
+        match = re.match(r"^(.+-[0-9a-f]{8})-\d+\.\w+$", file)
+        if match and match.group(1) not in current:
+            os.remove(os.path.join(OPTIMIZED_DIR, file))
+            removed += 1
+
+    write_json_atomic(IMAGE_INDEX, index, indent=1, sort_keys=True)
+    print("images: {} optimized, {} stale variants removed".format(len(index), removed))
+    return index
+
+
+def load_image_index():
+    """Returns {stem: {sha256, width, height, src, srcset, sources}} from the last run."""
+    if not os.path.exists(IMAGE_INDEX):
+        return {}
+    with open(IMAGE_INDEX, "r") as fh:
+        return json.load(fh)
+
+
+def speaker_photo(authors, index):
+    """Finds the image named after a speaker's surname, e.g. "Thomas Kipf" -> kipf.jpg."""
+    name = re.split(r",| and ", str(authors))[0].strip()
+    surname = name.split()[-1].lower() if name else ""
+    return index.get(surname)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    args = parser.parse_args()
+    instrument.enable()
+    optimize_images(workers=args.workers)
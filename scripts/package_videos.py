@@ -0,0 +1,119 @@
+"""Packages the downloaded poster videos into `poster_videos/<cmt_id>.<ext>.zip`.
+
+Usage:
+    python scripts/package_videos.py [--workers 4]
+
+Reads what `download_videos.py` left in `videos/` and builds one archive
+per paper in a process pool. Videos are already compressed, so they are
+stored without deflate and streamed from input to output in chunks.
+
+Each archive records the SHA-256 of its source in the zip comment. On a
+rerun an archive whose source hash is unchanged is left alone; the hash
+comes from `videos/manifest.json` when the manifest still matches the
+file, and is computed otherwise. Archives of a paper whose video changed
+extension are removed.
+"""
+import argparse
+import json
+import os
+import os.path as osp
+import re
+import shutil
+import time
+import zipfile
+from concurrent.futures import as_completed
+
+import instrument
+from download_videos import DEST as VIDEOS, MANIFEST
+from utils import file_sha256, process_pool
+
+DEST = 'poster_videos'
+CHUNK_SIZE = 1 << 20
+WORKERS = os.cpu_count() or 4
+COMMENT_PREFIX = b'sha256:'
+
+
+def _sources(videos=VIDEOS, manifest_path=MANIFEST):
+    """Returns {cmt_id: (path, sha256 or None)} for the finished videos."""
+    manifest = {}
+    if osp.exists(manifest_path):
+        with open(manifest_path, 'r') as fh:
+            manifest = json.load(fh)
+
+    sources = {}
+    for f in sorted(os.listdir(videos)) if osp.isdir(videos) else []:
+        match = re.match(r'^(\d+)(\.\w+)$', f)
+        if not match:
+            continue
+        cmt_id, path = int(match.group(1)), osp.join(videos, f)
+        entry = manifest.get(str(cmt_id), {})
+        known = entry.get('path') == path and entry.get('size') == osp.getsize(path)
+        sources[cmt_id] = (path, entry.get('sha256') if known else None)
+    return sources
+
+
+def _archived_hash(archive):
+    try:
+        with zipfile.ZipFile(archive) as zf:
+            comment = zf.comment
+    except (OSError, zipfile.BadZipFile):
+        return None
+    return comment[len(COMMENT_PREFIX):].decode() if comment.startswith(COMMENT_PREFIX) else None
+
+
+def _package(source, archive, sha256=None):
+    """Builds `archive` from `source` unless it already holds that content."""
+    if sha256 is None:
+        sha256 = file_sha256(source)
+    if _archived_hash(archive) == sha256:
+        return 'unchanged'
+
+    info = zipfile.ZipInfo(osp.basename(source), time.localtime(osp.getmtime(source))[:6])
+    info.compress_type = zipfile.ZIP_STORED
+    info.file_size = osp.getsize(source)
+    tmp = archive + '.tmp'
+    with zipfile.ZipFile(tmp, 'w') as zf:
+        zf.comment = COMMENT_PREFIX + sha256.encode()
+        with open(source, 'rb') as src, zf.open(info, 'w', force_zip64=True) as dst:
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+    os.replace(tmp, archive)
+    return 'written'
+
+
+@instrument.timed('package videos')
+def package_videos(workers=WORKERS, videos=VIDEOS, dest=DEST):
+    if not osp.exists(dest):
+        os.mkdir(dest)
+    sources = _sources(videos)
+
+    counts = {'written': 0, 'unchanged': 0, 'failed': 0, 'removed': 0}
+    with process_pool(workers) as pool:
+        futures = {}
+        for cmt_id, (path, sha256) in sources.items():
+            archive = osp.join(dest, osp.basename(path) + '.zip')
+            futures[pool.submit(_package, path, archive, sha256)] = cmt_id
+        for future in as_completed(futures):
+            try:
+                counts[future.result()] += 1
+            except Exception as err:
+                print(f'Couldn\'t package video ID={futures[future]:02d}: {err!r}')
+                counts['failed'] += 1
+
+    # A resubmitted video may have a different extension than before.
+    for f in os.listdir(dest):
+        match = re.match(r'^(\d+)(\.\w+)\.zip$', f)
+        if match and int(match.group(1)) in sources:
+            if osp.basename(sources[int(match.group(1))][0]) + '.zip' != f:
+                os.remove(osp.join(dest, f))
+                counts['removed'] += 1
+
+    print('{}: {written} written, {unchanged} unchanged, {removed} removed, {failed} failed'.format(dest, **counts))
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    args = parser.parse_args()
+    instrument.enable()
+    package_videos(workers=args.workers)
@@ -0,0 +1,149 @@
+"""Extracts text, page counts and first-page thumbnails from pdf/OOL_*.pdf.
+
+Usage:
+    python scripts/pdf_previews.py [--workers 4]
+
+PDFs are processed in a process pool with PyMuPDF (`pip install pymupdf`).
+Results are cached under each PDF's SHA-256 in `scripts/data/.cache/pdf`,
+so a rerun only opens new or replaced PDFs. Thumbnails are published as
+`pdf/previews/OOL_<id>.png`, and `PDF_INDEX` maps each paper id to its
+page count, thumbnail and extracted text; `make_program` reads it to fill
+in `pdf_pages` and `pdf_thumbnail` on the program pages. A thumbnail is
+only copied when its paper's PDF changed since the last run, and previews
+and cache entries of papers that are gone are removed.
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+import shutil
+from concurrent.futures import as_completed
+
+import instrument
+from utils import file_sha256, process_pool, write_json_atomic
+
+try:
+    import fitz
+except ImportError:
+    fitz = None
+
+
+PDF_PATTERN = "pdf/OOL_*.pdf"
+PREVIEW_DIR = "pdf/previews"
+PDF_CACHE_DIR = "scripts/data/.cache/pdf"
+PDF_INDEX = "scripts/data/.cache/pdfs.json"
+THUMBNAIL_WIDTH = 240
+WORKERS = os.cpu_count() or 4
+
+
+def _is_pdf(path):
+    # Checkouts without git-lfs have small pointer files in place of the PDFs.
+    with open(path, "rb") as fh:
+        return fh.read(5) == b"%PDF-"
+
+
+def _extract(path, digest):
+    """Runs in a worker: writes `<digest>.json` and `<digest>.png` to the cache."""
+    with fitz.open(path) as doc:
+        text = "\f".join(page.get_text() for page in doc)
+        first = doc[0]
+        zoom = THUMBNAIL_WIDTH / first.rect.width
+        first.get_pixmap(matrix=fitz.Matrix(zoom, zoom)).save(
+            os.path.join(PDF_CACHE_DIR, digest + ".png"))
+        info = {"pages": doc.page_count, "text": text}
+    write_json_atomic(os.path.join(PDF_CACHE_DIR, digest + ".json"), info)
+
+
+def _publish_thumbnail(digest, unique_id, published):
+    """Copies the cached thumbnail unless `published` (the last index's digest) matches."""
+    target = os.path.join(PREVIEW_DIR, "OOL_{}.png".format(unique_id))
+    if published != digest or not os.path.exists(target):
+        shutil.copyfile(os.path.join(PDF_CACHE_DIR, digest + ".png"), target)
+    return target
+
+
+def _prune(papers, index):
+    """Removes previews of papers not in `index` and cache entries of PDFs not in `papers`."""
+    removed = 0
+    for file in os.listdir(PREVIEW_DIR):
+        match = re.match(r"^OOL_(\d+)\.png$", file)
+        if match and match.group(1) not in index:
+            os.remove(os.path.join(PREVIEW_DIR, file))
+            removed += 1
+    digests = {digest for _, digest in papers.values()}
+    for file in os.listdir(PDF_CACHE_DIR):
+        if file.split(".", 1)[0] not in digests:
+            os.remove(os.path.join(PDF_CACHE_DIR, file))
+    return removed
+
+
+@instrument.timed()
+def extract_pdfs(pattern=PDF_PATTERN, workers=WORKERS):
+    """Brings the cache, the previews and `PDF_INDEX` up to date; returns the index."""
+    for directory in (PDF_CACHE_DIR, PREVIEW_DIR):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    papers = {}
+    for path in sorted(glob.glob(pattern)):
+        match = re.search(r"OOL_(\d+)\.pdf$", path)
+        if not match:
+            continue
+        if not _is_pdf(path):
+            print("{} is not a PDF, skipping".format(path))
+            continue
+        papers[int(match.group(1))] = (path, file_sha256(path))
+
+    missing = {digest: path for path, digest in papers.values()
+               if not os.path.exists(os.path.join(PDF_CACHE_DIR, digest + ".json"))}
+    if missing and fitz is None:
+        print("PyMuPDF is not installed; skipping {} new PDFs".format(len(missing)))
+        missing = {}
+    processed = 0
+    with process_pool(workers) as pool:
+        futures = {pool.submit(_extract, path, digest): path for digest, path in missing.items()}
+        for future in as_completed(futures):
+            try:
+                future.result()
+                processed += 1
+            except Exception as err:
+                print("Couldn't process {}: {!r}".format(futures[future], err))
+
+    previous = load_pdf_index()
+    index = {}
+    for unique_id, (path, digest) in sorted(papers.items()):
+        cached = os.path.join(PDF_CACHE_DIR, digest + ".json")
+        if not os.path.exists(cached):
+            continue
+        with open(cached, "r") as fh:
+            info = json.load(fh)
+        index[str(unique_id)] = {
+            "sha256": digest,
+            "pages": info["pages"],
+            "thumbnail": _publish_thumbnail(
+                digest, unique_id, previous.get(str(unique_id), {}).get("sha256")),
+            "text": info["text"],
+        }
+    write_json_atomic(PDF_INDEX, index)
+    removed = _prune(papers, index)
+    print("pdf: {} processed, {} cached, {} without results, {} previews removed".format(
+        processed, len(index) - processed, len(papers) - len(index), removed))
+    return index
+
+
+def load_pdf_index():
+    """Returns {unique_id: {sha256, pages, thumbnail, text}} from the last run."""
+    if not os.path.exists(PDF_INDEX):
+        return {}
+    with open(PDF_INDEX, "r") as fh:
+        return json.load(fh)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    args = parser.parse_args()
+    instrument.enable()
+    extract_pdfs(workers=args.workers)
@@ -0,0 +1,320 @@
+"""Make-style runner for the whole site-building pipeline.
+
+Usage:
+    python scripts/pipeline.py [targets...] [--force] [--dry-run] [--jobs 4]
+    python scripts/pipeline.py --list
+
+Each stage declares the files it reads and writes (including the scripts
+that produce its output) and the stages it depends on. A stage runs
+only if its inputs changed since it last
+succeeded, one of its outputs is missing, or a stage it depends on ran
+in this invocation. Stages whose dependencies are done run in parallel.
+
+Without targets the offline stages (DEFAULT_TARGETS) are brought up to
+date. Stages that talk to Zoom, SMTP or video hosts run only when named,
+e.g. `python scripts/pipeline.py zoom_meetings zoom_links`.
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import instrument
+import utils
+from optimize_images import IMAGE_INDEX
+from pdf_previews import PDF_INDEX
+
+
+STATE_PATH = "scripts/data/.cache/pipeline_state.json"
+SCRIPTS_DIR = os.path.relpath(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_TARGETS = ["jekyll_data", "program", "zoom_links", "poster_videos"]
+
+
+class Stage:
+
+    def __init__(self, name, run, inputs=(), outputs=(), deps=(), env=(), doc=""):
+        self.name = name
+        self.run = run
+        self.inputs = list(inputs)
+        self.env = list(env)
+        self.outputs = list(outputs)
+        self.deps = list(deps)
+        self.doc = doc
+
+
+def _make_jekyll_data():
+    from make_program import make_jekyll_data
+    make_jekyll_data()
+
+
+def _make_program():
+    from make_program import make_program
+    make_program()
+
+
+def _optimize_images():
+    from optimize_images import optimize_images
+    optimize_images()
+
+
+def _extract_pdfs():
+    from pdf_previews import extract_pdfs
+    extract_pdfs()
+
+
+def _add_zoom_links():
+    from make_program import add_zoom_links
+    add_zoom_links()
+
+
+def _create_poster_sessions():
+    from zoom import create_poster_sessions
+    create_poster_sessions()
+
+
+def _send_presenter_emails():
+    from send_emails import send_presenter_emails
+    failed = send_presenter_emails()
+    if failed:
+        raise RuntimeError("{} emails failed".format(len(failed)))
+
+
+def _download_videos():
+    import download_videos
+    if not os.environ.get("OOL_VIDEOS_CSV"):
+        raise RuntimeError("set OOL_VIDEOS_CSV to the CSV with the video links")
+    download_videos.main(os.environ["OOL_VIDEOS_CSV"])
+
+
+def _package_videos():
+    from package_videos import package_videos
+    if package_videos()["failed"]:
+        raise RuntimeError("some videos could not be packaged")
+
+
+def _code(*modules):
+    """The source files of `modules` (and utils), so editing them reruns the stage."""
+    return [os.path.join(SCRIPTS_DIR, name + ".py") for name in ("utils",) + modules]
+
+
+STAGES = [
+    Stage("images", _optimize_images,
+          inputs=["images/*.jpg", "images/*.jpeg", "images/*.png"] + _code("optimize_images"),
+          outputs=[IMAGE_INDEX],
+          doc="images/*.{jpg,png} -> images/optimized/ srcset variants"),
+    Stage("jekyll_data", _make_jekyll_data,
+          inputs=[utils.PRESENTATIONS_CSV, IMAGE_INDEX]
+          + _code("make_program", "search_index", "optimize_images"),
+          deps=["images"],
+          outputs=["_data/sessions.yml", "_data/speakers.yml", "search/papers.json"],
+          doc="presentations.csv -> _data/*.yml, search index, speaker photos"),
+    Stage("pdf_previews", _extract_pdfs,
+          inputs=["pdf/OOL_*.pdf"] + _code("pdf_previews"),
+          outputs=[PDF_INDEX],
+          doc="pdf/OOL_*.pdf -> text, page counts, pdf/previews/*.png"),
+    Stage("program", _make_program,
+          inputs=[utils.PRESENTATIONS_CSV, "_layouts/*.html"]
+          + _code("make_program", "render_pages", "pdf_previews"),
+          env=["OOL_RENDER_PAGES"],
+          outputs=["program"],
+          deps=["pdf_previews"],
+          doc="presentations.csv + meeting store + PDF index -> program/*.html"),
+    Stage("zoom_meetings", _create_poster_sessions,
+          inputs=["_data/sessions.yml"] + _code("zoom"),
+          outputs=[utils.MEETINGS_DB],
+          deps=["jekyll_data"],
+          doc="_data/sessions.yml -> Zoom meetings (uses the Zoom API)"),
+    Stage("zoom_links", _add_zoom_links,
+          inputs=[utils.MEETINGS_DB, "_layouts/*.html"]
+          + _code("make_program", "render_pages", "pdf_previews"),
+          outputs=["program"],
+          deps=["program"],
+          doc="meeting store -> meeting_url in program/*.html"),
+    Stage("presenter_emails", _send_presenter_emails,
+          inputs=[utils.PRESENTATIONS_CSV, utils.MEETINGS_DB,
+                  "scripts/data/zoom_accounts.csv", "scripts/templates/presenter.html"]
+          + _code("send_emails"),
+          deps=["zoom_meetings"],
+          doc="meeting store -> presenter emails (uses SMTP; skips already-sent)"),
+    Stage("videos", _download_videos,
+          inputs=["$OOL_VIDEOS_CSV"] + _code("download_videos"),
+          outputs=["videos"],
+          doc="$OOL_VIDEOS_CSV -> videos/ (downloads from Google Drive/Dropbox)"),
+    Stage("poster_videos", _package_videos,
+          inputs=["videos"] + _code("package_videos"),
+          outputs=["poster_videos"],
+          doc="videos/ -> poster_videos/*.zip"),
+]
+
+
+def _expand(path):
+    return os.path.expandvars(path)
+
+
+def _fingerprint(paths, env=()):
+    """Hashes the content of files and the listing (size, mtime) of directories.
+
+    Paths may contain environment variables and glob patterns. The values
+    of the `env` variables are included, for settings that change a
+    stage's output.
+    """
+    expanded = []
+    for path in map(_expand, paths):
+        matches = glob.glob(path) if glob.has_magic(path) else []
+        expanded.extend(matches or [path])
+    digest = hashlib.sha256()
+    for name in env:
+        digest.update("${}={}\0".format(name, os.environ.get(name, "")).encode())
+    for path in sorted(expanded):
+        digest.update(path.encode() + b"\0")
+        if os.path.isdir(path):
+            for root, _, files in sorted(os.walk(path)):
+                for name in sorted(files):
+                    stat = os.stat(os.path.join(root, name))
+                    digest.update("{}/{}:{}:{}\0".format(
+                        root, name, stat.st_size, stat.st_mtime_ns).encode())
+        elif os.path.exists(path):
+            utils.hash_file(digest, path)
+        else:
+            digest.update(b"<missing>")
+    return digest.hexdigest()
+
+
+def _read_state():
+    if os.path.exists(STATE_PATH):
+        with open(STATE_PATH, "r") as fh:
+            return json.load(fh)
+    return {}
+
+
+def _closure(targets, stages):
+    """Returns `targets` plus everything they depend on, in dependency order."""
+    order = []
+
+    def visit(name, path):
+        if name in path:
+            raise ValueError("dependency cycle: {}".format(" -> ".join(path + [name])))
+        if name in order:
+            return
+        for dep in stages[name].deps:
+            visit(dep, path + [name])
+        order.append(name)
+
+    for target in targets:
+        visit(target, [])
+    return order
+
+
+def _stale_reason(stage, state, ran):
+    if any(dep in ran for dep in stage.deps):
+        return "dependency ran"
+    missing = [p for p in stage.outputs if not os.path.exists(_expand(p))]
+    if missing:
+        return "missing {}".format(", ".join(missing))
+    if state.get(stage.name) != _fingerprint(stage.inputs, stage.env):
+        return "inputs changed" if stage.name in state else "never run"
+    return None
+
+
+def run(targets=None, force=False, dry_run=False, jobs=4, stages=STAGES):
+    """Brings `targets` up to date; returns the names of the stages that failed."""
+    stages = {stage.name: stage for stage in stages}
+    unknown = [t for t in targets or [] if t not in stages]
+    if unknown:
+        raise ValueError("unknown stages: {}".format(", ".join(unknown)))
+    order = _closure(targets or DEFAULT_TARGETS, stages)
+
+    state = _read_state()
+    done, ran, failed, skipped = set(), set(), [], set()
+    running = {}
+
+    def ready(name):
+        return name not in done and name not in running and all(d in done for d in stages[name].deps)
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while len(done) < len(order):
+            for name in order:
+                if not ready(name):
+                    continue
+                stage = stages[name]
+                if any(dep in failed or dep in skipped for dep in stage.deps):
+                    print("[{}] skipped: a dependency failed".format(name))
+                    skipped.add(name)
+                    done.add(name)
+                    continue
+                reason = "forced" if force else _stale_reason(stage, state, ran)
+                if reason is None:
+                    print("[{}] up to date".format(name))
+                    done.add(name)
+                    continue
+                print("[{}] {}: {}".format(name, "would run" if dry_run else "running", reason))
+                if dry_run:
+                    ran.add(name)
+                    done.add(name)
+                    continue
+                fingerprint = _fingerprint(stage.inputs, stage.env)
+                running[name] = (pool.submit(_run_stage, stage), fingerprint)
+
+            if not running:
+                continue
+            finished, _ = wait([f for f, _ in running.values()], return_when=FIRST_COMPLETED)
+            for name, (future, fingerprint) in list(running.items()):
+                if future not in finished:
+                    continue
+                del running[name]
+                done.add(name)
+                ran.add(name)
+                try:
+                    seconds = future.result()
+                except Exception as err:
+                    print("[{}] failed: {!r}".format(name, err))
+                    failed.append(name)
+                    state.pop(name, None)
+                else:
+                    print("[{}] done in {:.2f}s".format(name, seconds))
+                    # Fingerprint taken before running, so edits made while the
+                    # stage ran are picked up next time.
+                    state[name] = fingerprint
+                utils.write_json_atomic(STATE_PATH, state, indent=1, sort_keys=True)
+
+    return failed
+
+
+def _run_stage(stage):
+    start = time.perf_counter()
+    with instrument.stage(stage.name):
+        stage.run()
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    """Command-line entry point; also used by `python scripts/make_program.py`."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("targets", nargs="*", help="stages to bring up to date")
+    parser.add_argument("--force", action="store_true", help="run the stages even if up to date")
+    parser.add_argument("--dry-run", action="store_true", help="only print what would run")
+    parser.add_argument("--jobs", type=int, default=4, help="stages to run in parallel")
+    parser.add_argument("--list", action="store_true", help="list the stages")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for stage in STAGES:
+            deps = " (after {})".format(", ".join(stage.deps)) if stage.deps else ""
+            print("{:<18} {}{}".format(stage.name, stage.doc, deps))
+        return 0
+
+    instrument.enable()
+    try:
+        failed = run(args.targets, force=args.force, dry_run=args.dry_run, jobs=args.jobs)
+    except ValueError as err:  # unknown stage or a dependency cycle
+        parser.error(str(err))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
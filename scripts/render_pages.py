@@ -0,0 +1,224 @@
+"""Renders program pages to final HTML in Python instead of in Jekyll.
+
+Each `program/ool_<id>.html` is normally a front-matter stub that Jekyll
+runs through `_layouts/paper.html` and `_layouts/default.html` on every
+build. `make_program(render=True)` (or OOL_RENDER_PAGES=1) writes the
+finished HTML instead; without front matter Jekyll just copies the file.
+
+The layouts are compiled once per process into Python functions. Only the
+Liquid that the layouts use is supported: `{% if %}/{% elsif %}/{% else %}`
+with ==, !=, <, >, <=, >=, contains, and/or (evaluated right to left, as
+Liquid does), and `{{ ... }}` output with the `replace`, `default`,
+`escape`, `downcase` and `upcase` filters. Anything else raises
+`UnsupportedLiquid` so a layout change can't silently render wrong. Values
+are looked up the way Jekyll sees them: the page's front matter is parsed
+as YAML, `layout` is the current layout's front matter.
+"""
+
+import functools
+import html
+import os
+import re
+import yaml
+
+from utils import process_pool
+
+
+LAYOUTS_DIR = "_layouts"
+WORKERS = os.cpu_count() or 4
+CHUNK_SIZE = 64
+
+# Jekyll's YAML_FRONT_MATTER_REGEXP.
+_FRONT_MATTER = re.compile(r"\A(---\s*\n.*?\n?)^((---|\.\.\.)\s*$\n?)", re.M | re.S)
+_TAG = re.compile(r"(\{\{.*?\}\}|\{%.*?%\})", re.S)
+_LITERAL = re.compile(r"""^(?:"[^"]*"|'[^']*'|-?\d+(?:\.\d+)?|true|false|nil|null|empty|blank)$""")
+_VARIABLE = re.compile(r"^[A-Za-z_][\w-]*(?:\.[\w-]+|\[\d+\])*$")
+_COMPARISON = re.compile(r"^(.+?)\s*(==|!=|<>|<=|>=|<|>|\scontains\s)\s*(.+)$")
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+# Jekyll also exposes `site`, `paginator`, ...; the layouts we render don't use them.
+SCOPE_ROOTS = ("page", "layout", "content")
+
+
+class UnsupportedLiquid(ValueError):
+    """Raised for Liquid the compiler doesn't implement."""
+
+
+def split_front_matter(text):
+    """Returns (front matter dict, content) the way Jekyll splits a file."""
+    match = _FRONT_MATTER.match(text)
+    if not match:
+        return {}, text
+    return yaml.load(match.group(1), Loader=_YAML_LOADER) or {}, text[match.end():]
+
+
+def _lookup(scope, path):
+    value = scope
+    for part in re.findall(r"[\w-]+", path):
+        if isinstance(value, dict):
+            value = value.get(part)
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return None
+    return value
+
+
+def _to_s(value):
+    if value is None:
+        return ""
+    if value is True or value is False:
+        return "true" if value else "false"
+    if isinstance(value, list):
+        return "".join(_to_s(v) for v in value)
+    return str(value)
+
+
+def _compare(op, left, right):
+    try:
+        if op == "contains":
+            return left is not None and right is not None and _to_s(right) in (
+                left if isinstance(left, list) else _to_s(left))
+        if op == "==":
+            return left == right
+        if op in ("!=", "<>"):
+            return left != right
+        if left is None or right is None:
+            return False
+        return {"<": left < right, ">": left > right, "<=": left <= right, ">=": left >= right}[op]
+    except TypeError:
+        return False
+
+
+def _truthy(value):
+    # Only nil and false are falsy in Liquid; "" and 0 are truthy.
+    return value is not None and value is not False
+
+
+_FILTERS = {
+    "replace": lambda value, old, new: _to_s(value).replace(_to_s(old), _to_s(new)),
+    "default": lambda value, default: value if _truthy(value) and value != "" else default,
+    "escape": lambda value: html.escape(_to_s(value)),
+    "downcase": lambda value: _to_s(value).lower(),
+    "upcase": lambda value: _to_s(value).upper(),
+}
+
+
+def _expression(source):
+    """Compiles a Liquid value (literal or variable) to a Python expression."""
+    source = source.strip()
+    if _LITERAL.match(source):
+        if source in ("nil", "null", "empty", "blank"):
+            if source in ("empty", "blank"):
+                raise UnsupportedLiquid(source)
+            return "None"
+        if source in ("true", "false"):
+            return source.capitalize()
+        return source if source[0] not in "\"'" else repr(source[1:-1])
+    if _VARIABLE.match(source) and re.match(r"[\w-]+", source).group() in SCOPE_ROOTS:
+        return "_lookup(scope, {!r})".format(source)
+    raise UnsupportedLiquid(source)
+
+
+def _condition(source):
+    # Liquid has no precedence: `a and b or c` is `a and (b or c)`.
+    parts = re.split(r"\s+(and|or)\s+", source.strip(), maxsplit=1)
+    if len(parts) == 3:
+        left, op, rest = parts
+        return "({} {} {})".format(_condition(left), op, _condition(rest))
+    match = _COMPARISON.match(source.strip())
+    if match:
+        left, op, right = match.groups()
+        return "_compare({!r}, {}, {})".format(op.strip(), _expression(left), _expression(right))
+    return "_truthy({})".format(_expression(source))
+
+
+def _output(source):
+    value, *filters = [part.strip() for part in re.split(r"\|(?=(?:[^\"']|\"[^\"]*\"|'[^']*')*$)", source)]
+    code = _expression(value)
+    for flt in filters:
+        name, _, args = flt.partition(":")
+        name = name.strip()
+        if name not in _FILTERS:
+            raise UnsupportedLiquid("filter {!r}".format(name))
+        args = [_expression(arg) for arg in re.findall(r"\"[^\"]*\"|'[^']*'|[^,\s]+", args)]
+        code = "_FILTERS[{!r}]({})".format(name, ", ".join([code] + args))
+    return "_to_s({})".format(code)
+
+
+def compile_liquid(source, name="<template>"):
+    """Compiles a Liquid template to a function of the scope dict returning text."""
+    lines = ["def render(scope):", " out = []", " append = out.append"]
+    depth = 1
+    opened = []
+    for token in _TAG.split(source):
+        if not token:
+            continue
+        indent = " " * depth
+        if token[:1] == "{" and _TAG.fullmatch(token) and (token[2:3] == "-" or token[-3:-2] == "-"):
+            raise UnsupportedLiquid("whitespace control in {}".format(name))
+        if token.startswith("{{"):
+            lines.append("{}append({})".format(indent, _output(token[2:-2])))
+        elif token.startswith("{%"):
+            tag, _, arg = token[2:-2].strip().partition(" ")
+            if tag == "if":
+                lines.append("{}if {}:".format(indent, _condition(arg)))
+                lines.append("{} pass".format(indent))
+                opened.append("if")
+                depth += 1
+            elif tag in ("elsif", "else") and opened:
+                head = "elif {}:".format(_condition(arg)) if tag == "elsif" else "else:"
+                lines.append("{}{}".format(" " * (depth - 1), head))
+                lines.append("{}pass".format(indent))
+            elif tag == "endif" and opened:
+                opened.pop()
+                depth -= 1
+            else:
+                raise UnsupportedLiquid("{{% {} %}} in {}".format(tag, name))
+        else:
+            lines.append("{}append({!r})".format(indent, token))
+    if opened:
+        raise UnsupportedLiquid("unclosed {{% if %}} in {}".format(name))
+    lines.append(" return ''.join(out)")
+    namespace = {"_lookup": _lookup, "_to_s": _to_s, "_compare": _compare,
+                 "_truthy": _truthy, "_FILTERS": _FILTERS}
+    exec(compile("\n".join(lines), name, "exec"), namespace)
+    return namespace["render"]
+
+
+@functools.lru_cache(maxsize=None)
+def load_layout(name, directory=LAYOUTS_DIR):
+    """Returns (front matter, compiled template) of `_layouts/<name>.html`."""
+    path = os.path.join(directory, name + ".html")
+    with open(path, "r", encoding="utf-8") as fh:
+        front_matter, content = split_front_matter(fh.read())
+    return front_matter, compile_liquid(content, path)
+
+
+def render_page(text, directory=LAYOUTS_DIR):
+    """Renders a page (front matter + content) through its layout chain, like Jekyll."""
+    page, content = split_front_matter(text)
+    if _TAG.search(content):
+        content = compile_liquid(content, "page")({"page": page, "layout": {}, "content": ""})
+    name = page.get("layout")
+    while name:
+        layout, template = load_layout(name, directory)
+        content = template({"page": page, "layout": layout, "content": content})
+        name = layout.get("layout")
+    return content
+
+
+def _render_chunk(items):
+    return [(path, render_page(text)) for path, text in items]
+
+
+def render_pages(pages, workers=WORKERS):
+    """Renders {path: page text} in a process pool; returns {path: html}."""
+    items = list(pages.items())
+    chunks = [items[i:i + CHUNK_SIZE] for i in range(0, len(items), CHUNK_SIZE)]
+    if workers <= 1 or len(chunks) <= 1:
+        return dict(_render_chunk(items))
+    rendered = {}
+    with process_pool(workers) as pool:
+        for chunk in pool.map(_render_chunk, chunks):
+            rendered.update(chunk)
+    return rendered
@@ -0,0 +1,147 @@
+"""Builds the paper search index that `make_jekyll_data` publishes.
+
+The index is one JSON file (`SEARCH_INDEX`) with integer postings so the
+browser never needs the abstracts:
+
+    {
+      "version": 1,
+      "docs": [[paper_id, title], ...],     # doc number = position
+      "terms": ["affordanc", "learn", ...], # sorted, for prefix search
+      "postings": [[3, 1, 7], ...]          # per term, delta-encoded doc numbers
+    }
+
+Titles, abstracts and formatted authors are lower-cased, split into
+words, stripped of stop words and stemmed with `stem`. A query is
+tokenized the same way; each query term matches every index term it is
+a prefix of (a binary search over `terms`), so "affor" finds
+"affordances". Docs are numbered in paper-id order and the postings are
+small deltas, which keeps the file small and gzip-friendly.
+
+papers.html only shows its search box when `SEARCH_INDEX` is deployed,
+loads the index on first use of the box and filters the paper list with a JavaScript copy of `STOP_WORDS`, `_SUFFIXES`,
+`stem` and `tokenize`; change them together.
+
+Tokens are cached per paper under a hash of its text, so a rebuild only
+re-tokenizes the papers that changed, and the file is only rewritten
+when its content changes.
+"""
+
+import functools
+import hashlib
+import json
+import os
+import re
+import unicodedata
+
+from utils import write_json_atomic
+
+
+SEARCH_INDEX = "search/papers.json"
+TOKEN_CACHE = "scripts/data/.cache/search_tokens.json"
+FIELDS = ["title", "abstract", "authors"]
+INDEX_VERSION = 1
+# Part of the token cache key; bump it whenever `tokenize` or `stem` change.
+TOKENIZER_VERSION = 2
+
+STOP_WORDS = frozenset("""
+a an and are as at be by can for from has have in into is it its of on or our
+that the their these this to we which with while
+""".split())
+
+# Digits, lower-case Latin letters with their accented forms (Latin-1
+# Supplement without "÷", Latin Extended-A and -B) and combining accents
+# left over by NFKC; anything else separates words. Spelled out so that
+# papers.html can use the very same class.
+_WORD = re.compile("[0-9a-z\u00df-\u00f6\u00f8-\u024f\u0300-\u036f]+")
+# (suffix, replacement, minimum stem length), tried in order; first match wins.
+_SUFFIXES = [
+    ("ational", "ate", 2), ("ization", "ize", 2), ("fulness", "ful", 2),
+    ("iveness", "ive", 2), ("ousness", "ous", 2), ("ations", "ate", 2),
+    ("ation", "ate", 2), ("ments", "", 3), ("ment", "", 3), ("ness", "", 3),
+    ("ities", "", 3), ("ity", "", 3), ("ingly", "", 3), ("edly", "", 3),
+    ("ings", "", 3), ("ing", "", 3), ("ies", "i", 2), ("ied", "i", 2),
+    ("ed", "", 3), ("ly", "", 3), ("sses", "ss", 2), ("es", "", 4),
+    ("ers", "er", 2), ("ss", "ss", 0), ("us", "us", 0), ("is", "is", 0),
+    ("s", "", 2),
+]
+
+
+@functools.lru_cache(maxsize=None)
+def stem(word):
+    """A small suffix-stripping stemmer, cheap to mirror in the browser."""
+    for suffix, replacement, min_stem in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= min_stem:
+            word = word[:len(word) - len(suffix)] + replacement
+            break
+    # "affordance" and "affordances" should meet at "affordanc".
+    if word.endswith("e") and len(word) > 4:
+        word = word[:-1]
+    return word
+
+
+def tokenize(text):
+    """Returns the distinct stemmed terms of `text`, in order of appearance."""
+    terms = {}
+    text = unicodedata.normalize("NFKC", str(text).lower())
+    for word in dict.fromkeys(_WORD.findall(text)):
+        if word not in STOP_WORDS and (len(word) > 1 or word in "0123456789"):
+            terms.setdefault(stem(word), None)
+    return list(terms)
+
+
+def _doc_key(paper):
+    text = "\0".join([str(TOKENIZER_VERSION)] + [str(paper.get(field, "")) for field in FIELDS])
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _load_cache():
+    if os.path.exists(TOKEN_CACHE):
+        with open(TOKEN_CACHE, "r") as fh:
+            return json.load(fh)
+    return {}
+
+
+def build_search_index(papers):
+    """Returns the index for `papers` (dicts with id and `FIELDS`) and how many were tokenized."""
+    cache = _load_cache()
+    new_cache = {}
+    tokenized = 0
+    docs, postings = [], {}
+    for n, paper in enumerate(sorted(papers, key=lambda paper: paper["id"])):
+        key = _doc_key(paper)
+        terms = cache.get(key)
+        if terms is None:
+            terms = tokenize(" ".join(str(paper.get(field, "")) for field in FIELDS))
+            tokenized += 1
+        new_cache[key] = terms
+        docs.append([int(paper["id"]), paper["title"]])
+        for term in terms:
+            postings.setdefault(term, []).append(n)
+    write_json_atomic(TOKEN_CACHE, new_cache, separators=(",", ":"))
+
+    terms = sorted(postings)
+    deltas = []
+    for term in terms:
+        numbers = postings[term]
+        deltas.append([numbers[0]] + [b - a for a, b in zip(numbers, numbers[1:])])
+    index = {"version": INDEX_VERSION, "docs": docs, "terms": terms, "postings": deltas}
+    return index, tokenized
+
+
+def write_search_index(papers, path=SEARCH_INDEX):
+    """Writes the index for `papers` to `path` if it changed."""
+    index, tokenized = build_search_index(papers)
+    content = json.dumps(index, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if os.path.exists(path):
+        with open(path, "rb") as fh:
+            if fh.read() == content:
+                print("{}: unchanged".format(path))
+                return
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(path + ".tmp", "wb") as fh:
+        fh.write(content)
+    os.replace(path + ".tmp", path)
+    print("{}: {} papers ({} re-tokenized), {} terms, {} bytes".format(
+        path, len(index["docs"]), tokenized, len(index["terms"]), len(content)))
@@ -5,21 +5,42 @@ settings: https://myaccount.google.com/u/4/lesssecureapps?pli=1
 
 See also: https://realpython.com/python-send-email/
 
+Every delivered message is appended to `scripts/data/sent_emails.jsonl`;
+rerunning after a dropped connection only sends what is left. To try a
+run locally, start an SMTP stand-in with
+`python -m aiosmtpd -n -l localhost:1025` and pass
+`--server localhost --port 1025 --no-ssl --no-login`.
+
 """
 
+import argparse
+import functools
+import json
+import os
+import re
 import smtplib
+import socket
 import ssl
+import string
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import pandas as pd
 
 from secret import SENDER_EMAIL, SENDER_PASSWORD
-from utils import read_meeting_json, meeting_json_exists
-from utils import load_presentation_data, load_meet_and_greet_data
+from utils import read_meeting_json, load_meeting_jsons
+from utils import load_presentation_data
+from utils import TokenBucket
+import instrument
 
 
 PORT = 465  # For SSL
 SMTP_SERVER = "smtp.gmail.com"
+SMTP_CONNECTIONS = 3
+MESSAGES_PER_MINUTE = 20  # stay well under Gmail's sending limits
+LEDGER = "scripts/data/sent_emails.jsonl"
 
 
 def get_zoom_users():
@@ -36,10 +57,11 @@ def get_zoom_users():
 
 
 def get_zoom_meetings(ids, prefix):
+    all_meetings = load_meeting_jsons(prefix)
     meetings = []
     for unique_id in ids:
-        if meeting_json_exists("{}_{}".format(prefix, unique_id)):
-            meeting_info = read_meeting_json("{}_{}".format(prefix, unique_id))
+        if str(unique_id) in all_meetings:
+            meeting_info = all_meetings[str(unique_id)]
             meeting_info["unique_id"] = unique_id
             meetings.append(meeting_info)
     meetings = pd.DataFrame(meetings)
@@ -50,40 +72,224 @@ def get_zoom_meetings(ids, prefix):
     return meetings
 
 
+#### Bulk sending ####
+
+def _is_transient(err):
+    """True for SMTP failures worth retrying: dropped connections and 4xx replies."""
+    if isinstance(err, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)):
+        return True
+    if isinstance(err, smtplib.SMTPResponseException):
+        return 400 <= err.smtp_code < 500
+    if isinstance(err, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in err.recipients.values())
+    return isinstance(err, (ConnectionError, socket.timeout))
+
+
+class SendLedger:
+    """Append-only record of delivered messages, so reruns skip them."""
+
+    def __init__(self, path=LEDGER):
+        self.path = path
+        self._lock = threading.Lock()
+        self._sent = set()
+        if os.path.exists(path):
+            with open(path, "r") as fh:
+                for line in fh:
+                    if line.strip():
+                        self._sent.add(json.loads(line)["key"])
+
+    def __contains__(self, key):
+        return key in self._sent
+
+    def record(self, key, recipient):
+        with self._lock:
+            with open(self.path, "a") as fh:
+                fh.write(json.dumps({
+                    "key": key, "recipient": recipient, "sent_at": time.time()}) + "\n")
+                fh.flush()
+                os.fsync(fh.fileno())
+            self._sent.add(key)
+
+
+class BulkSender:
+    """Sends messages over a small pool of SMTP connections.
+
+    Sending is throttled to `per_minute` messages, connections that drop
+    are re-opened and each delivery is recorded in a `SendLedger`.
+    Pass `use_ssl=False, login=False` to talk to a local stand-in such as
+    `python -m aiosmtpd -n -l localhost:1025`.
+    """
+
+    def __init__(self, server=SMTP_SERVER, port=PORT, use_ssl=True, login=True,
+                 connections=SMTP_CONNECTIONS, per_minute=MESSAGES_PER_MINUTE,
+                 ledger=None, max_attempts=3):
+        self.server = server
+        self.port = port
+        self.use_ssl = use_ssl
+        self.login = login
+        self.connections = connections
+        self.max_attempts = max_attempts
+        self.ledger = ledger if ledger is not None else SendLedger()
+        self._bucket = TokenBucket(per_minute / 60.0)
+        self._local = threading.local()
+        self._open = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self.use_ssl:
+            context = ssl.create_default_context()
+            server = smtplib.SMTP_SSL(self.server, self.port, context=context)
+        else:
+            server = smtplib.SMTP(self.server, self.port)
+        if self.login:
+            server.login(SENDER_EMAIL, SENDER_PASSWORD)
+        with self._lock:
+            self._open.append(server)
+        return server
+
+    def _connection(self, reconnect=False):
+        server = getattr(self._local, "server", None)
+        if server is None or reconnect:
+            if server is not None:
+                self._close(server)
+            server = self._local.server = self._connect()
+        return server
+
+    def _close(self, server):
+        with self._lock:
+            if server in self._open:
+                self._open.remove(server)
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+    def _send(self, key, recipient, message):
+        for attempt in range(self.max_attempts):
+            self._bucket.acquire()
+            start = time.perf_counter()
+            try:
+                self._connection(reconnect=attempt > 0).sendmail(
+                    SENDER_EMAIL, recipient, message)
+                instrument.record_http("smtp", "SEND", self.server, 250, time.perf_counter() - start)
+                break
+            except OSError as err:  # smtplib.SMTPException is an OSError too
+                instrument.record_http(
+                    "smtp", "SEND", self.server, type(err).__name__, time.perf_counter() - start)
+                # Permanent rejections (5xx) would only fail again.
+                if not _is_transient(err) or attempt == self.max_attempts - 1:
+                    raise
+        self.ledger.record(key, recipient)
+        instrument.count("emails_sent")
+
+    def send_all(self, messages):
+        """Sends `messages`, a list of (key, recipient, message) tuples.
+
+        Messages whose key is already in the ledger are skipped. Returns the
+        keys that failed.
+        """
+        pending = [m for m in messages if m[0] not in self.ledger]
+        print("{} messages, {} already sent".format(
+            len(messages), len(messages) - len(pending)))
+
+        failed = []
+        start = time.time()
+        try:
+            with ThreadPoolExecutor(max_workers=self.connections) as pool:
+                futures = {pool.submit(self._send, *m): m for m in pending}
+                for future in as_completed(futures):
+                    key, recipient, _ = futures[future]
+                    try:
+                        future.result()
+                    except (smtplib.SMTPException, OSError) as err:
+                        print("Failed to send {} to {}: {}".format(key, recipient, err))
+                        failed.append(key)
+                    else:
+                        print("Sent {} to {}".format(key, recipient))
+        finally:
+            for server in list(self._open):
+                self._close(server)
+
+        print("Sent {} messages in {:.1f}s, {} failed".format(
+            len(pending) - len(failed), time.time() - start, len(failed)))
+        return failed
+
+
+@functools.lru_cache(maxsize=None)
+def load_template(path):
+    """Reads an email template once and returns it with the keys its fields use.
+
+    "{paper[title]}" and "{paper.title}" both only need "paper" in the data.
+    """
+    with open(path, "r") as fh:
+        body = fh.read()
+    fields = {re.split(r"[.\[]", name, 1)[0]
+              for _, name, _, _ in string.Formatter().parse(body) if name}
+    return body, frozenset(fields)
+
+
+def render_template(path, data):
+    body, fields = load_template(path)
+    missing = [field for field in fields if field not in data]
+    if missing:
+        raise KeyError("{} is missing template fields: {}".format(path, ", ".join(sorted(missing))))
+    return body.format_map(data)
+
+
 #### Presenter emails ####
 
+PRESENTER_TEMPLATE = "scripts/templates/presenter.html"
+
+
 def get_presenter_email_body(data):
     message = MIMEMultipart("alternative")
     message["Subject"] = "OOL Presentation Instructions"
     message["From"] = SENDER_EMAIL
     message["To"] = data["presenter_email"]
 
-    with open("scripts/templates/presenter.html", "r") as fh:
-        body = fh.read()
-    body = body.format(**data)
+    body = render_template(PRESENTER_TEMPLATE, data)
 
     message.attach(MIMEText(body, "html"))
     return message.as_string()
 
 
-def send_presenter_emails():
-    # Load meeting data.
+def get_presenter_meetings():
+    """Joins each paper with its meeting and host account."""
     papers = load_presentation_data()
     meetings = get_zoom_meetings(papers["unique_id"].unique(), prefix="OOL")
     users = get_zoom_users()
     meetings = pd.merge(meetings, users, on="host_id")
     meetings = pd.merge(meetings, papers, on="unique_id")
-    meetings = meetings.to_dict(orient="records")
+    return meetings.to_dict(orient="records")
+
 
-    context = ssl.create_default_context()
-    with smtplib.SMTP_SSL(SMTP_SERVER, PORT, context=context) as server:
-        server.login(SENDER_EMAIL, SENDER_PASSWORD)
+def send_presenter_emails(sender=None):
+    with instrument.stage("load presenter meetings"):
+        meetings = get_presenter_meetings()
+
+    # Render everything up front so a template error can't stop us halfway.
+    with instrument.stage("render presenter emails"):
+        messages = []
         for meeting in meetings:
-            print("{} ({})".format(meeting["presenter_email"], meeting["title"]))
-            message = get_presenter_email_body(meeting)
-            server.sendmail(SENDER_EMAIL, meeting["presenter_email"], message)
+            key = "presenter:{}:{}".format(meeting["unique_id"], meeting["presenter_email"])
+            messages.append((key, meeting["presenter_email"], get_presenter_email_body(meeting)))
+
+    if sender is None:
+        sender = BulkSender()
+    with instrument.stage("send presenter emails"):
+        return sender.send_all(messages)
 
 
 if __name__ == "__main__":
-    send_presenter_emails()
- 
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--server", default=SMTP_SERVER)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--no-ssl", dest="use_ssl", action="store_false")
+    parser.add_argument("--no-login", dest="login", action="store_false")
+    parser.add_argument("--connections", type=int, default=SMTP_CONNECTIONS)
+    parser.add_argument("--per-minute", type=float, default=MESSAGES_PER_MINUTE)
+    args = parser.parse_args()
+    instrument.enable()
+    send_presenter_emails(BulkSender(
+        server=args.server, port=args.port, use_ssl=args.use_ssl, login=args.login,
+        connections=args.connections, per_minute=args.per_minute))
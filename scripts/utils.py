@@ -1,6 +1,17 @@
 import pandas as pd
+import glob
+import functools
+import hashlib
+import inspect
 import os
 import json
+import multiprocessing
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import instrument
 
 
 def format_authors(x):
@@ -26,49 +37,159 @@ def format_authors(x):
   return x
 
 
-def load_presentation_data():
-    data = pd.read_csv("scripts/data/presentations.csv")
+PRESENTATIONS_CSV = "scripts/data/presentations.csv"
+CACHE_DIR = "scripts/data/.cache"
+CATEGORICAL_COLUMNS = ["kind", "track", "session_title"]
+
+_presentation_data = {}
+_presentation_lock = threading.Lock()
+
+
+def hash_file(hasher, path, chunk_size=1 << 20):
+    """Feeds the contents of `path` to `hasher` in chunks; returns `hasher`."""
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            hasher.update(chunk)
+    return hasher
+
+
+def file_sha256(path):
+    """Returns the hex SHA-256 of a file without reading it into memory at once."""
+    return hash_file(hashlib.sha256(), path).hexdigest()
+
+
+def process_pool(max_workers):
+    """Returns a ProcessPoolExecutor that is safe to start from a threaded process.
+
+    Forking while other threads run (e.g. from a pipeline stage) can copy
+    locks they hold into the children, so then the workers come from a
+    forkserver (spawn where that's unavailable) instead of a plain fork.
+    """
+    context = None
+    if threading.active_count() > 1:
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+
+
+def write_json_atomic(path, data, **kwargs):
+    """Dumps `data` to `path` via a temporary file, so readers never see half a file.
+
+    Missing parent directories are created; `kwargs` go to `json.dump`.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path + ".tmp", "w") as fh:
+        json.dump(data, fh, **kwargs)
+    os.replace(path + ".tmp", path)
+
+
+def _parse_presentation_data(path):
+    data = pd.read_csv(path)
     data["session_title"] = data["session"].replace({
         "invited": "Invited Talk",
         "opening": "Opening Remarks",
         "3:30-4:30pm": "Session 1 (3:30-4:30pm UTC)",
         "11:00-11:59pm": "Session 2 (11:00-11:59pm UTC)",
     })
-    data["session_id"] = data["session"].replace({
+    data["session_id"] = data["session"].map({
         "invited": 0,
         "opening": 0,
         "3:30-4:30pm": 1,
         "11:00-11:59pm": 2,
-    })
+    }).astype("Int64")
+    unmapped = data.loc[data["session_id"].isna(), ["unique_id", "session"]]
+    if len(unmapped):
+        # Left as <NA>, so these rows are in neither a session nor the speakers.
+        print("No session id for {} presentations: {}".format(
+            len(unmapped), ", ".join("{} ({})".format(*row) for row in unmapped.itertuples(index=False))))
     data = data.drop(columns=["session"])
-    data["authors"] = data["authors"].apply(format_authors)
+    # Format each distinct author list once.
+    authors = data["authors"].unique()
+    data["authors"] = data["authors"].map(dict(zip(authors, map(format_authors, authors))))
+    for col in CATEGORICAL_COLUMNS:
+        if col in data:
+            data[col] = data[col].astype("category")
     return data
 
 
-def load_meet_and_greet_data():
-    def _get_names(meeting):
-        cols = sorted([x for x in meeting.index if x.startswith("name_")])
-        names = [meeting[x] for x in cols]
-        names = [x for x in names if x]
-        if len(names) == 2:
-            names = "{} and {}".format(*names)
-        else:
-            names = ", ".join(names[:-1]) + ", and " + names[-1]
-        return names
-
-    def _get_emails(meeting):
-        cols = sorted([x for x in meeting.index if x.startswith("email_")])
-        emails = [meeting[x] for x in cols]
-        emails = [x for x in emails if x]
-        return ", ".join(emails)
-
-    data = pd.read_csv("scripts/data/meet_and_greet.csv")
+@instrument.timed()
+def load_presentation_data(path=PRESENTATIONS_CSV):
+    """Loads presentations.csv, parsing it at most once per content version.
+
+    The parsed frame is pickled under `CACHE_DIR`, keyed by the CSV's
+    SHA-256 and the parsing code (`_parser_digest`), and also kept in
+    memory for repeated calls in one process.
+    Callers get their own copy. Safe to call from concurrent pipeline stages.
+    """
+    digest = file_sha256(path)
+    with _presentation_lock:
+        if digest not in _presentation_data:
+            _presentation_data[digest] = _load_presentation_data(path, digest)
+    return _presentation_data[digest].copy()
+
+
+@functools.lru_cache(maxsize=None)
+def _parser_digest():
+    """Hashes the code that shapes the frame, so editing it invalidates the pickles."""
+    source = "".join(inspect.getsource(f) for f in (format_authors, _parse_presentation_data))
+    return hashlib.sha256((source + repr(CATEGORICAL_COLUMNS)).encode("utf-8")).hexdigest()
+
+
+def _load_presentation_data(path, digest):
+    cache_path = os.path.join(CACHE_DIR, "presentations-{}-{}.pkl".format(
+        digest[:16], _parser_digest()[:8]))
+    if os.path.exists(cache_path):
+        data = pd.read_pickle(cache_path)
+    else:
+        data = _parse_presentation_data(path)
+        if not os.path.exists(CACHE_DIR):
+            os.makedirs(CACHE_DIR)
+        for stale in glob.glob(os.path.join(CACHE_DIR, "presentations-*.pkl")):
+            os.remove(stale)
+        data.to_pickle(cache_path + ".tmp")
+        os.replace(cache_path + ".tmp", cache_path)
+    return data
+
+
+MEET_AND_GREET_DETAIL_KEYS = ["institution", "academic_status", "google_scholar", "website"]
+
+
+def _join_names(names):
+    names = list(names)
+    if not names:
+        return ""
+    if len(names) == 2:
+        return "{} and {}".format(*names)
+    return ", ".join(names[:-1]) + ", and " + names[-1]
+
+
+def _stack_slots(data, prefix):
+    """Melts the `<prefix>_<j>` columns into (unique_id, slot, value) rows, dropping blanks."""
+    cols = sorted([x for x in data.columns if x.startswith(prefix + "_")])
+    long = data[["unique_id"] + cols].melt(
+        id_vars="unique_id", var_name="slot", value_name=prefix)
+    long["slot"] = long["slot"].str[len(prefix) + 1:]
+    long = long[long[prefix].astype(bool)]
+    return long.sort_values(["unique_id", "slot"], kind="stable")
+
+
+@instrument.timed()
+def load_meet_and_greet_data(path="scripts/data/meet_and_greet.csv",
+                             details_path="scripts/data/meet_and_greet_details.csv"):
+    data = pd.read_csv(path)
     data.index.name = "unique_id"
     data = data.reset_index()
     data = data.fillna("")
-    data["names"] = ""
-    data["emails"] = ""
     data = data.rename(columns={"timeslot": "session"})
+
+    names = _stack_slots(data, "name").groupby("unique_id")["name"].agg(_join_names)
+    emails = _stack_slots(data, "email")
+    data["names"] = data["unique_id"].map(names).fillna("")
+    data["emails"] = data["unique_id"].map(
+        emails.groupby("unique_id")["email"].agg(", ".join)).fillna("")
+
     data["session_title"] = data["session"].replace({
         "1:00-1:30 PM": "1:00-1:30pm GMT",
         "8:00-8:30 PM": "8:00-8:30pm GMT"
@@ -78,45 +199,162 @@ def load_meet_and_greet_data():
         "8:00-8:30 PM": 2
     })
 
-    detail_keys = ["institution", "academic_status", "google_scholar", "website"]
-    for key in detail_keys:
-        for j in [1, 2, 3, 4]:
-            data["{}_{}".format(key, j)] = ""
-
-    all_details = pd.read_csv("scripts/data/meet_and_greet_details.csv")
-    all_details = all_details.set_index("email")
+    all_details = pd.read_csv(details_path)
     all_details = all_details.fillna("")
+    all_details = all_details.drop_duplicates(subset="email")
+    keys = MEET_AND_GREET_DETAIL_KEYS
+
+    details = emails.merge(
+        all_details[["email"] + keys], on="email", how="left", indicator=True)
+    missing = details.loc[details["_merge"] == "left_only", "email"].unique()
+    if len(missing):
+        print("No meet and greet details for {} emails: {}".format(
+            len(missing), ", ".join(missing)))
 
-    for i, row in data.iterrows():
-        data.loc[i, "names"] = _get_names(row)
-        data.loc[i, "emails"] = _get_emails(row)
-        for j in [1, 2, 3, 4]:
-            email = row["email_{}".format(j)]
-            if not email:
-                continue
-            details = all_details.loc[email]
-            for key in detail_keys:
-                data.loc[i, "{}_{}".format(key, j)] = details[key]
+    details = details.pivot(index="unique_id", columns="slot", values=keys)
+    detail_cols = ["{}_{}".format(key, j) for key in keys for j in [1, 2, 3, 4]]
+    details.columns = ["{}_{}".format(key, j) for key, j in details.columns]
+    details = details.reindex(index=data["unique_id"], columns=detail_cols)
+    details = details.astype(object).fillna("")
+    for col in detail_cols:
+        data[col] = details[col].to_numpy()
 
     return data
 
 
+class TokenBucket:
+    """Thread-safe token bucket allowing `rate` acquisitions per second."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available; returns the time spent waiting."""
+        waited = 0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+MEETINGS_DIR = "scripts/data/meetings"
+MEETINGS_DB = "scripts/data/meetings.sqlite"
+
+
+class MeetingStore:
+    """All meeting JSON (plus users and other Zoom state) in one SQLite file.
+
+    Replaces the old one-file-per-meeting directory, which is imported
+    the first time the database is created.
+    """
+
+    def __init__(self, path=MEETINGS_DB, legacy_dir=MEETINGS_DIR):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        is_new = not os.path.exists(path)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS meetings (name TEXT PRIMARY KEY, data TEXT NOT NULL)")
+        if is_new and legacy_dir and os.path.isdir(legacy_dir):
+            self.migrate(legacy_dir)
+
+    def migrate(self, directory):
+        """Imports every `<name>.json` file in `directory`."""
+        items = {}
+        for filename in sorted(os.listdir(directory)):
+            name, ext = os.path.splitext(filename)
+            if ext == ".json":
+                with open(os.path.join(directory, filename), "r") as fh:
+                    items[name] = json.load(fh)
+        self.put_many(items)
+        return len(items)
+
+    def exists(self, name):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT 1 FROM meetings WHERE name = ?", (name,)).fetchone()
+        return row is not None
+
+    def get(self, name):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT data FROM meetings WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            raise KeyError(name)
+        return json.loads(row[0])
+
+    def get_many(self, names):
+        """Returns the entries for `names` that exist, keyed by name."""
+        names = list(names)
+        found = {}
+        with self._lock:
+            for start in range(0, len(names), 500):
+                chunk = names[start:start + 500]
+                rows = self._db.execute(
+                    "SELECT name, data FROM meetings WHERE name IN ({})".format(
+                        ", ".join("?" * len(chunk))), chunk).fetchall()
+                found.update((name, json.loads(data)) for name, data in rows)
+        return found
+
+    def put(self, name, data):
+        self.put_many({name: data})
+
+    def put_many(self, items):
+        """Upserts `items` (name -> data) in a single transaction."""
+        rows = [(name, json.dumps(data)) for name, data in items.items()]
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO meetings (name, data) VALUES (?, ?)", rows)
+
+    def load_all(self, prefix=""):
+        """Returns every entry whose name starts with `prefix`, keyed by name."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT name, data FROM meetings WHERE name >= ? AND name < ?",
+                (prefix, prefix + chr(0x10FFFF))).fetchall()
+        return {name: json.loads(data) for name, data in rows}
+
+
+_meeting_store = None
+_meeting_store_lock = threading.Lock()
+
+
+def meeting_store():
+    global _meeting_store
+    with _meeting_store_lock:
+        if _meeting_store is None:
+            _meeting_store = MeetingStore()
+    return _meeting_store
+
 
 def meeting_json_exists(name):
-    path = os.path.join("scripts/data/meetings", "{}.json".format(name))
-    return os.path.exists(path)
+    return meeting_store().exists(name)
 
 
 def save_meeting_json(name, data):
-    path = os.path.join("scripts/data/meetings", "{}.json".format(name))
-    if not os.path.exists("scripts/data/meetings"):
-        os.makedirs("scripts/data/meetings")
-    with open(path, "w") as fh:
-        json.dump(data, fh)
+    meeting_store().put(name, data)
 
 
 def read_meeting_json(name):
-    path = os.path.join("scripts/data/meetings", "{}.json".format(name))
-    with open(path, "r") as fh:
-        return json.load(fh)
+    return meeting_store().get(name)
+
 
+def load_meeting_jsons(prefix):
+    """Returns all meetings named `<prefix>_<id>`, keyed by the id string."""
+    meetings = meeting_store().load_all(prefix + "_")
+    return {name[len(prefix) + 1:]: data for name, data in meetings.items()}
@@ -7,7 +7,6 @@
 
 
 Assumptions this script makes:
-- You have <=30 users.
 - Your users have emails that fit a format like
   "my.zoom.email+{}@gmail.com", where "{}" is an
   integer going from 0 to you max user count.
@@ -36,177 +35,599 @@ Instructions:
     TOKEN: the JWT token (see site above)
     PASSWORD: the password for your meetings
     USER_EMAIL_TEMPLATE: a python format string for
-      the host email accounts, e.g. "my.zoom.email+{}@gmail.com"
+      the host email accounts, e.g. "my.zoom.email+{}@gmail.com";
+      hosts are numbered from 1 and reused across sessions that
+      don't overlap, so you only need as many accounts as rooms
+      open at once (`create_poster_sessions` prints the number)
 - Put session data in `_data/sessions.yml`, see e.g.
   https://github.com/oolworkshop/oolworkshop.github.io/blob/master/_data/sessions.yml
 - Edit `create_poster_sessions` as needed to fit your
   particular workshop format.
-- Call `create_poster_sessions()`.
+- To try things out without using up real quota, run the local
+  stand-in `python scripts/mock_zoom.py` and set
+  ZOOM_API_URL=http://localhost:8000/v2 (or pass --api-url).
+- Call `create_poster_sessions(dry_run=True)` to print the sync
+  plan, then `create_poster_sessions()` to apply it. Only meetings
+  whose settings differ from the cached JSON are touched, and creates
+  beyond today's quota are left for the next day's run.
 
 
 """
 
 import requests
+import requests.adapters
+import argparse
+import bisect
+import collections
+import datetime
+import email.utils
+import heapq
 import json
 import logging
 import os
 import jsondiff
+import threading
 import time
 import yaml
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import re
 import random
 import hashlib
 from textwrap import dedent
 
 from secret import TOKEN, USER_EMAIL_TEMPLATE, PASSWORD
-from utils import meeting_json_exists, save_meeting_json, read_meeting_json
+from utils import meeting_json_exists, save_meeting_json, read_meeting_json, meeting_store
+from utils import TokenBucket
+import instrument
+
+
+# Set ZOOM_API_URL (or pass --api-url) to use e.g. the local `mock_zoom.py`.
+API_URL = os.environ.get("ZOOM_API_URL", "https://api.zoom.us/v2")
+REQUESTS_PER_SECOND = 10
+DAILY_MEETING_LIMIT = 100
+MAX_RETRIES = 5
+POOL_SIZE = 10
+
+
+class DailyLimitExceeded(RuntimeError):
+	"""Raised when creating a meeting would exceed the daily quota."""
+
+
+class ZoomClient:
+	"""Pooled, rate-limited client for the Zoom API.
+
+	All requests share one `requests.Session`, so connections (and the
+	auth headers) are reused. Requests are paced by a token bucket, 429 and
+	5xx responses are retried honouring Retry-After, and meeting creation
+	is capped at `daily_meeting_limit` per UTC day (persisted in the
+	meeting store as "daily_quota" so it survives restarts).
+	"""
+
+	def __init__(self, token, base_url=API_URL, rate=REQUESTS_PER_SECOND,
+				 daily_meeting_limit=DAILY_MEETING_LIMIT, max_retries=MAX_RETRIES):
+		self.base_url = base_url
+		self.max_retries = max_retries
+		self.daily_meeting_limit = daily_meeting_limit
+		self.counters = collections.Counter()
+		self._bucket = TokenBucket(rate)
+		self._lock = threading.Lock()
+
+		self.session = requests.Session()
+		self.session.headers.update({
+			'authorization': "Bearer {}".format(token),
+			'content-type': "application/json"
+		})
+		adapter = requests.adapters.HTTPAdapter(
+			pool_connections=1, pool_maxsize=POOL_SIZE)
+		self.session.mount("https://", adapter)
+		self.session.mount("http://", adapter)
+
+	def _count(self, key, n=1):
+		with self._lock:
+			self.counters[key] += n
+
+	def meetings_created_today(self):
+		today = datetime.datetime.now(datetime.timezone.utc).date().isoformat()
+		if meeting_json_exists("daily_quota"):
+			quota = read_meeting_json("daily_quota")
+			if quota["date"] == today:
+				return quota["meetings_created"]
+		return 0
+
+	def _reserve_meeting(self):
+		today = datetime.datetime.now(datetime.timezone.utc).date().isoformat()
+		with self._lock:
+			created = self.meetings_created_today()
+			if created >= self.daily_meeting_limit:
+				raise DailyLimitExceeded(
+					"already created {} meetings today".format(created))
+			save_meeting_json(
+				"daily_quota", {"date": today, "meetings_created": created + 1})
+
+	def _release_meeting(self):
+		"""Gives back a reservation whose create didn't go through."""
+		today = datetime.datetime.now(datetime.timezone.utc).date().isoformat()
+		with self._lock:
+			created = self.meetings_created_today()
+			if created > 0:
+				save_meeting_json(
+					"daily_quota", {"date": today, "meetings_created": created - 1})
+
+	def _retry_delay(self, response, attempt):
+		retry_after = response.headers.get("Retry-After")
+		if retry_after:
+			try:
+				return float(retry_after)
+			except ValueError:
+				when = email.utils.parsedate_to_datetime(retry_after)
+				return max(0, (when - datetime.datetime.now(when.tzinfo)).total_seconds())
+		return 2 ** attempt + random.random()
+
+	def _send(self, method, endpoint, json, params):
+		for attempt in range(self.max_retries + 1):
+			waited = self._bucket.acquire()
+			self._count("throttled_seconds", waited)
+
+			start = time.perf_counter()
+			response = self.session.request(
+				method, self.base_url + endpoint, json=json, params=params)
+			instrument.record_http(
+				"zoom", method, endpoint, response.status_code, time.perf_counter() - start)
+			self._count("requests")
+			self._count("{} {}".format(method, response.status_code))
+			print("{} {} {}".format(method, response.url, response.status_code))
+
+			retryable = response.status_code == 429 or response.status_code >= 500
+			if not retryable or attempt == self.max_retries:
+				break
+			delay = self._retry_delay(response, attempt)
+			if delay > 60:
+				# e.g. the daily limit; no point waiting for it.
+				break
+			self._count("retries")
+			time.sleep(delay)
+		return response
+
+	def request(self, method, endpoint, json=None, params=None):
+		"""Performs a request, retrying rate-limited and server errors."""
+		creates_meeting = method == "POST" and re.match(r"^/users/[^/]+/meetings$", endpoint)
+		if creates_meeting:
+			self._reserve_meeting()
+		try:
+			response = self._send(method, endpoint, json, params)
+		except requests.exceptions.RequestException:
+			if creates_meeting:
+				self._release_meeting()
+			raise
+		if creates_meeting and not 200 <= response.status_code < 300:
+			self._release_meeting()
+
+		if response.status_code == 429 and response.headers.get("X-RateLimit-Type") == "Daily":
+			self._count("errors")
+			raise DailyLimitExceeded(response.text)
+		try:
+			response.raise_for_status()
+		except requests.exceptions.HTTPError:
+			self._count("errors")
+			print(response.text)
+			raise
+
+		if response.status_code == 204 or not response.content:
+			return None
+		return response.json()
+
+	def get(self, endpoint, params=None):
+		"""Performs a GET request to the Zoom API."""
+		return self.request("GET", endpoint, params=params)
+
+	def patch(self, endpoint, json, params=None):
+		"""Performs a PATCH request to the Zoom API."""
+		return self.request("PATCH", endpoint, json=json, params=params)
+
+	def post(self, endpoint, json, params=None):
+		"""Performs a POST request to the Zoom API."""
+		return self.request("POST", endpoint, json=json, params=params)
+
+	def summary(self):
+		counts = ", ".join(
+			"{}: {:g}".format(k, v) for k, v in sorted(self.counters.items()))
+		print("Zoom API: {}".format(counts))
+
+
+client = ZoomClient(TOKEN)
+
+
+USER_PAGE_SIZE = 300  # the maximum Zoom allows
+USER_CACHE_TTL = 60 * 60  # seconds
+USER_MIN_REFRESH = 60  # seconds between refetches for an unknown email
+
+
+class UserDirectory:
+	"""In-memory index of the account's Zoom users.
+
+	Users are fetched page by page (pages after the first concurrently),
+	cached in the meeting store as "users" and indexed by email and id.
+	The index is refreshed once it is older than `ttl` seconds. An unknown
+	email refetches the users at most once per `min_refresh` seconds, and
+	emails still missing afterwards aren't looked up again until the next
+	refresh.
+	"""
+
+	def __init__(self, ttl=USER_CACHE_TTL, workers=4, min_refresh=USER_MIN_REFRESH):
+		self.ttl = ttl
+		self.workers = workers
+		self.min_refresh = min_refresh
+		self._users = None
+		self._by_email = {}
+		self._by_id = {}
+		self._missing = set()
+		self._fetched_at = 0
+		self._lock = threading.RLock()
+
+	def _fetch_page(self, page_number):
+		params = {
+			"status": "active",
+			"page_size": USER_PAGE_SIZE,
+			"page_number": page_number
+		}
+		return client.get("/users", params)
+
+	def _fetch_all(self):
+		first = self._fetch_page(1)
+		users = list(first["users"])
+		page_count = first.get("page_count") or 1
+		if page_count > 1:
+			with ThreadPoolExecutor(max_workers=self.workers) as pool:
+				for page in pool.map(self._fetch_page, range(2, page_count + 1)):
+					users.extend(page["users"])
+		return users
 
+	def _index(self, users, fetched_at):
+		self._users = users
+		self._by_email = {user["email"]: user for user in users}
+		self._by_id = {user["id"]: user for user in users}
+		self._missing = set()
+		self._fetched_at = fetched_at
+
+	def refresh(self, force=False):
+		with self._lock:
+			if self._users is None and not force and meeting_json_exists("users"):
+				fetched_at = 0
+				if meeting_json_exists("users_fetched_at"):
+					fetched_at = read_meeting_json("users_fetched_at")
+				self._index(read_meeting_json("users"), fetched_at)
+			if force or self._users is None or time.time() - self._fetched_at > self.ttl:
+				now = time.time()
+				users = self._fetch_all()
+				save_meeting_json("users", users)
+				save_meeting_json("users_fetched_at", now)
+				self._index(users, now)
+
+	def users(self):
+		self.refresh()
+		return self._users
+
+	def by_email(self, email):
+		self.refresh()
+		with self._lock:
+			if email not in self._by_email and email not in self._missing:
+				# The user may have been added since the last fetch.
+				if time.time() - self._fetched_at >= self.min_refresh:
+					self.refresh(force=True)
+				if email not in self._by_email:
+					self._missing.add(email)
+			return self._by_email[email]
+
+	def by_id(self, user_id):
+		self.refresh()
+		return self._by_id[user_id]
+
+
+user_directory = UserDirectory()
 
-def _get(endpoint, params=None):
-	"""Performs a GET request to the Zoom API."""
-	headers = {
-	    'authorization': "Bearer {}".format(TOKEN),
-	    'content-type': "application/json"
-	}
 
-	response = requests.get(
-		"https://api.zoom.us/v2" + endpoint,
-		headers=headers,
-		params=params)
+def get_users():
+	return user_directory.users()
 
-	print("GET {} {}".format(response.url, response.status_code))
 
+def find_user(user_email):
 	try:
-		response.raise_for_status()
-	except requests.exceptions.HTTPError:
-		print(response.json())
-		raise
+		return user_directory.by_email(user_email)
+	except KeyError:
+		raise ValueError("no such user: {}".format(user_email))
 
-	return response.json()
 
+def meeting_settings(topic, start_time, password, duration, waiting_room):
+	"""Returns the fields we manage on an existing meeting."""
+	if len(password) > 10:
+		raise ValueError("password length must be <10")
 
-def _patch(endpoint, json, params=None):
-	"""Performs a PATCH request to the Zoom API."""
-	headers = {
-	    'authorization': "Bearer {}".format(TOKEN),
-	    'content-type': "application/json"
+	return {
+		"topic": topic,
+		"start_time": start_time,
+		"password": password,
+		"duration": duration,
+		"settings": {
+			"join_before_host": not waiting_room,
+			"waiting_room": waiting_room
+		}
 	}
 
-	response = requests.patch(
-		"https://api.zoom.us/v2" + endpoint,
-		headers=headers,
-		json=json,
-		params=params)
 
-	print("PATCH {} {}".format(response.url, response.status_code))
-
-	try:
-		response.raise_for_status()
-	except requests.exceptions.HTTPError:
-		print(response.json())
-		raise
-
-
-def _post(endpoint, json, params=None):
-	"""Performs a POST request to the Zoom API."""
-	headers = {
-	    'authorization': "Bearer {}".format(TOKEN),
-	    'content-type': "application/json"
+def _create_settings(settings):
+	"""Returns the full body for creating a meeting with `settings`."""
+	return {
+		"topic": settings["topic"],
+		"type": 2,  # scheduled meeting
+		"start_time": settings["start_time"],
+		"duration": settings["duration"],
+		"password": settings["password"],
+		"settings": dict({
+			"host_video": True,
+			"participant_video": False,
+			"mute_upon_entry": True,
+			"watermark": False,
+			"use_pmi": False,
+			"approval_type": 2,
+			"audio": "both",
+			"auto_recording": "none",
+			"meeting_authentication": True,
+		}, **settings["settings"])
 	}
 
-	response = requests.post(
-		"https://api.zoom.us/v2" + endpoint,
-		headers=headers,
-		json=json,
-		params=params)
-
-	print("POST {} {}".format(response.url, response.status_code))
-
-	try:
-		response.raise_for_status()
-	except requests.exceptions.HTTPError:
-		print(response.json())
-		raise
-
-	return response.json()
-
 
-def get_users():
-	if meeting_json_exists("users"):
-		return read_meeting_json("users")
-
-	else:
-		params = {
-			"status": "active",
-			"page_size": 30,
-			"page_number": 1
+def _project(current, desired):
+	"""Restricts `current` to the (nested) keys present in `desired`."""
+	projected = {}
+	for key, value in desired.items():
+		if key not in current:
+			continue
+		if isinstance(value, dict) and isinstance(current[key], dict):
+			projected[key] = _project(current[key], value)
+		else:
+			projected[key] = current[key]
+	return projected
+
+
+def _as_patch(diff, desired):
+	"""Turns a compact jsondiff of `desired` into a PATCH body."""
+	if jsondiff.replace in diff:
+		return desired
+	patch = {}
+	for key, value in diff.items():
+		if isinstance(value, dict) and isinstance(desired[key], dict):
+			patch[key] = _as_patch(value, desired[key])
+		else:
+			patch[key] = desired[key]
+	return patch
+
+
+def plan_meeting_sync(meetings):
+	"""Diffs the desired meetings against the cached meeting JSON.
+
+	`meetings` is a list of dicts with keys "unique_id", "user_email" and
+	"settings" (as returned by `meeting_settings`). Returns a dict with
+	"create", "update" and "unchanged" lists; updates carry a minimal
+	"patch" containing only the fields that differ.
+	"""
+	plan = {"create": [], "update": [], "unchanged": []}
+	cached = meeting_store().get_many(m["unique_id"] for m in meetings)
+	for meeting in meetings:
+		current = cached.get(meeting["unique_id"])
+		if current is None:
+			plan["create"].append(meeting)
+			continue
+
+		diff = jsondiff.diff(_project(current, meeting["settings"]), meeting["settings"])
+		if diff:
+			plan["update"].append(dict(
+				meeting, current=current, patch=_as_patch(diff, meeting["settings"])))
+		else:
+			plan["unchanged"].append(meeting)
+	return plan
+
+
+def print_meeting_plan(plan, daily_meeting_limit=None):
+	"""Prints a summary of `plan`, splitting creates into daily batches."""
+	print("{} create, {} update, {} unchanged".format(
+		len(plan["create"]), len(plan["update"]), len(plan["unchanged"])))
+	for meeting in plan["update"]:
+		print("  update {}: {}".format(
+			meeting["unique_id"], ", ".join(sorted(meeting["patch"]))))
+
+	if daily_meeting_limit is None:
+		daily_meeting_limit = client.daily_meeting_limit
+	remaining = max(0, daily_meeting_limit - client.meetings_created_today())
+	creates = plan["create"]
+	batches = [creates[:remaining]]
+	for start in range(remaining, len(creates), daily_meeting_limit):
+		batches.append(creates[start:start + daily_meeting_limit])
+	for day, batch in enumerate(batches):
+		if batch:
+			print("  day {}: create {} ({} .. {})".format(
+				day + 1, len(batch), batch[0]["unique_id"], batch[-1]["unique_id"]))
+	return batches
+
+
+def _sync_one(action, meeting, host_locks, quota_reached):
+	"""Creates or updates a single meeting; returns its new JSON or None."""
+	if action == "update":
+		current = meeting["current"]
+		with host_locks[current.get("host_id")]:
+			client.patch("/meetings/{}".format(current["id"]), json=meeting["patch"])
+			if "password" in meeting["patch"]:
+				# The join URL embeds the encrypted password, so refresh it.
+				updated = client.get("/meetings/{}".format(current["id"]))
+			else:
+				updated = _merge(current, meeting["patch"])
+		save_meeting_json(meeting["unique_id"], updated)
+		return updated
+
+	if quota_reached.is_set():
+		return None
+	user = find_user(meeting["user_email"])
+	url = "/users/{}/meetings".format(user["id"])
+	with host_locks[user["id"]]:
+		try:
+			created = client.post(url, json=_create_settings(meeting["settings"]))
+		except DailyLimitExceeded:
+			quota_reached.set()
+			return None
+	save_meeting_json(meeting["unique_id"], created)
+	return created
+
+
+def apply_meeting_sync(plan, workers=1):
+	"""Sends the API calls needed to carry out `plan`.
+
+	Up to `workers` calls run at once, at most one per host account; the
+	client's token bucket keeps the combined rate under Zoom's limit.
+	Creates stop (and are left for the next run) once today's quota is
+	used up. A failing meeting doesn't abort the run. Returns the synced
+	meetings and the failures, both keyed by unique_id.
+	"""
+	synced = meeting_store().get_many(m["unique_id"] for m in plan["unchanged"])
+
+	if plan["create"]:
+		get_users()  # warm the user cache before fanning out
+	host_locks = collections.defaultdict(threading.Lock)
+	quota_reached = threading.Event()
+	failed = {}
+	jobs = [("update", m) for m in plan["update"]] + [("create", m) for m in plan["create"]]
+	with ThreadPoolExecutor(max_workers=workers) as pool:
+		futures = {
+			pool.submit(_sync_one, action, meeting, host_locks, quota_reached): meeting
+			for action, meeting in jobs
 		}
-		users = _get("/users", params)["users"]
-		save_meeting_json("users", users)
-		return users
-
-
-def find_user(user_email):
-	users = get_users()
-	for user in users:
-		if user["email"] == user_email:
-			return user
-	raise ValueError("no such user: {}".format(user_email))
+		for future in as_completed(futures):
+			unique_id = futures[future]["unique_id"]
+			try:
+				result = future.result()
+			except (requests.exceptions.RequestException, ValueError) as err:
+				print("Failed to sync {}: {}".format(unique_id, err))
+				failed[unique_id] = err
+			else:
+				if result is not None:
+					synced[unique_id] = result
+
+	if quota_reached.is_set():
+		print("Daily meeting limit reached; rerun tomorrow to create the rest.")
+	return synced, failed
+
+
+def _merge(current, patch):
+	merged = dict(current)
+	for key, value in patch.items():
+		if isinstance(value, dict) and isinstance(merged.get(key), dict):
+			merged[key] = _merge(merged[key], value)
+		else:
+			merged[key] = value
+	return merged
 
 
 def create_or_update_meeting(
 	unique_id, user_email, topic, start_time, password,
 	duration, waiting_room):
 
-	if len(password) > 10:
-		raise ValueError("password length must be <10")
-
-	if meeting_json_exists(unique_id):
-		meeting_id = read_meeting_json(unique_id)['id']
-		settings = {
-			"topic": topic,
-			"start_time": start_time,
-			"password": password,
-			"duration": duration,
-			"settings": {
-				"join_before_host": not waiting_room,
-				"waiting_room": waiting_room
-			}
-		}
-		_patch("/meetings/{}".format(meeting_id), json=settings)
-		meeting = _get("/meetings/{}".format(meeting_id))
-
-	else:
-		settings = {
-			"topic": topic,
-			"type": 2,  # scheduled meeting
-			"start_time": start_time,
-			"duration": duration,
-			"password": password,
-			"settings": {
-				"host_video": True,
-				"participant_video": False,
-				"join_before_host": not waiting_room,
-				"mute_upon_entry": True,
-				"watermark": False,
-				"use_pmi": False,
-				"approval_type": 2,
-				"audio": "both",
-				"auto_recording": "none",
-				"waiting_room": waiting_room,
-				"meeting_authentication": True,
-			}
-		}
-
-		user = find_user(user_email)
-		url = "/users/{}/meetings".format(user["id"])
-		meeting = _post(url, json=settings)
-
-	save_meeting_json(unique_id, meeting)
-	return meeting
-
-
-def create_poster_sessions():
+	meeting = {
+		"unique_id": unique_id,
+		"user_email": user_email,
+		"settings": meeting_settings(
+			topic, start_time, password, duration, waiting_room),
+	}
+	synced, failed = apply_meeting_sync(plan_meeting_sync([meeting]))
+	if unique_id in failed:
+		raise failed[unique_id]
+	if unique_id not in synced:
+		# Only creates are skipped, and only once the quota is used up.
+		raise DailyLimitExceeded("daily meeting limit reached; {} was not created".format(unique_id))
+	return synced[unique_id]
+
+
+HOST_TURNAROUND = datetime.timedelta(minutes=15)
+_HOST_EMAIL = re.compile("^{}$".format(
+	re.escape(USER_EMAIL_TEMPLATE).replace(re.escape("{}"), r"(\d+)")))
+
+
+def _interval(settings, turnaround=HOST_TURNAROUND):
+	start = datetime.datetime.strptime(settings["start_time"], "%Y-%m-%dT%H:%M:%SZ")
+	return start, start + datetime.timedelta(minutes=settings["duration"]) + turnaround
+
+
+def _current_host(meeting, users_by_id):
+	"""Returns the USER_EMAIL_TEMPLATE index hosting an existing meeting, if known."""
+	email = meeting.get("host_email") or users_by_id.get(meeting.get("host_id"), {}).get("email")
+	match = _HOST_EMAIL.match(email or "")
+	return int(match.group(1)) if match else None
+
+
+def assign_hosts(meetings, pinned=None, turnaround=HOST_TURNAROUND):
+	"""Assigns host accounts so that no host has two overlapping meetings.
+
+	This is interval-graph colouring: meetings are taken in order of start
+	time, and each gets the lowest-numbered host that is free by then
+	(`turnaround` after its previous meeting ended), so hosts are reused
+	across sessions. `pinned` maps unique_id to the host of meetings that
+	already exist; they keep it and other meetings are scheduled around
+	them. Returns ({unique_id: host index}, minimum number of hosts), where
+	the minimum is the largest number of meetings running at once. Without
+	pinned meetings the assignment uses exactly that many hosts.
+	"""
+	pinned = pinned or {}
+	intervals = {m["unique_id"]: _interval(m["settings"], turnaround) for m in meetings}
+
+	busy = collections.defaultdict(list)  # host -> sorted pinned intervals
+	for unique_id, host in pinned.items():
+		if unique_id in intervals:
+			bisect.insort(busy[host], intervals[unique_id])
+
+	def conflicts(host, start, end):
+		slots = busy.get(host, [])
+		i = bisect.bisect_left(slots, (start, start))
+		return (i < len(slots) and slots[i][0] < end) or (i > 0 and slots[i - 1][1] > start)
+
+	assignment = {}
+	free = []  # hosts free since the last start time, lowest index first
+	running = []  # (end, host) of assigned meetings still running
+	next_host = 1
+	for unique_id, (start, end) in sorted(intervals.items(), key=lambda item: item[1]):
+		if unique_id in pinned:
+			assignment[unique_id] = pinned[unique_id]
+			continue
+		while running and running[0][0] <= start:
+			heapq.heappush(free, heapq.heappop(running)[1])
+		rejected = []
+		while free and conflicts(free[0], start, end):
+			rejected.append(heapq.heappop(free))
+		if free:
+			host = heapq.heappop(free)
+		else:
+			while next_host in busy and conflicts(next_host, start, end):
+				rejected.append(next_host)
+				next_host += 1
+			host = next_host
+			next_host += 1
+		for other in rejected:
+			heapq.heappush(free, other)
+		assignment[unique_id] = host
+		heapq.heappush(running, (end, host))
+
+	# The chromatic number of an interval graph is its largest clique.
+	events = sorted([(start, 1) for start, _ in intervals.values()] +
+					[(end, -1) for _, end in intervals.values()])
+	overlap = most = 0
+	for _, delta in events:
+		overlap += delta
+		most = max(most, overlap)
+	return assignment, most
+
+
+def create_poster_sessions(dry_run=False, workers=8, retry_failed=False):
+	"""Syncs one meeting per paper in `_data/sessions.yml`.
+
+	Papers that fail are saved to the "failed_meetings" list; pass
+	`retry_failed=True` to sync only those.
+	"""
 	# These are in GMT.
 	session_times = {
 		1: "2020-07-17T15:30:00Z",
@@ -216,22 +637,61 @@ def create_poster_sessions():
 	# TODO: update this to use `load_presentation_data` rather
 	# than the session yaml.
 	with open("_data/sessions.yml", "r") as fh:
-		sessions = yaml.load(fh)
+		sessions = yaml.safe_load(fh)
 
-	i = 1
+	meetings = []
 	for session in sessions:
 		for paper in session["papers"]:
-			meeting = create_or_update_meeting(
-				unique_id="OOL_{}".format(paper["id"]),
-				user_email=USER_EMAIL_TEMPLATE.format(i),
-				topic=paper["title"],
-				start_time=session_times[paper["session"]],
-				password=PASSWORD,
-				duration=60,  # minutes
-				waiting_room=True)
-			time.sleep(1)  # to prevent ratelimiting
-			i += 1
+			meetings.append({
+				"unique_id": "OOL_{}".format(paper["id"]),
+				"settings": meeting_settings(
+					topic=paper["title"],
+					start_time=session_times[paper["session"]],
+					password=PASSWORD,
+					duration=60,  # minutes
+					waiting_room=True),
+			})
+
+	# Meetings that already exist keep their host; only new ones are placed.
+	cached = meeting_store().get_many(m["unique_id"] for m in meetings)
+	users = read_meeting_json("users") if meeting_json_exists("users") else []
+	users_by_id = {user["id"]: user for user in users}
+	pinned = {}
+	for unique_id, meeting in cached.items():
+		host = _current_host(meeting, users_by_id)
+		if host is not None:
+			pinned[unique_id] = host
+	hosts, min_hosts = assign_hosts(meetings, pinned)
+	for meeting in meetings:
+		meeting["user_email"] = USER_EMAIL_TEMPLATE.format(hosts[meeting["unique_id"]])
+	print("{} rooms need at least {} hosts; using {} host accounts".format(
+		len(meetings), min_hosts, len(set(hosts.values()))))
+
+	if retry_failed and meeting_json_exists("failed_meetings"):
+		retry = set(read_meeting_json("failed_meetings"))
+		meetings = [m for m in meetings if m["unique_id"] in retry]
+
+	with instrument.stage("plan meeting sync"):
+		plan = plan_meeting_sync(meetings)
+	print_meeting_plan(plan)
+	if not dry_run:
+		with instrument.stage("apply meeting sync"):
+			synced, failed = apply_meeting_sync(plan, workers=workers)
+		save_meeting_json("failed_meetings", sorted(failed))
+		if failed:
+			print("{} failed, rerun with retry_failed=True: {}".format(
+				len(failed), ", ".join(sorted(failed))))
+	client.summary()
 
 
 if __name__ == "__main__":
-	create_poster_sessions()
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--dry-run", action="store_true", help="only print the sync plan")
+	parser.add_argument("--workers", type=int, default=8, help="meetings synced concurrently")
+	parser.add_argument("--retry-failed", action="store_true", help="only sync the failures of the last run")
+	parser.add_argument("--api-url", default=API_URL, help="Zoom API base URL")
+	args = parser.parse_args()
+	client.base_url = args.api_url
+	instrument.enable()
+	create_poster_sessions(
+		dry_run=args.dry_run, workers=args.workers, retry_failed=args.retry_failed)